@@ -0,0 +1,212 @@
+"""
+Benchmark harness: builds representative graphs, drives them headlessly
+and reports tick throughput, per-tick latency and object growth as JSON.
+
+    PYTHONPATH=. python bench.py --ticks 10000 > run.json
+    PYTHONPATH=. python bench.py -g transposers --depth 200
+
+Latencies are per `clock(i)` call (context tick, root fire and settle), in
+microseconds. `objects_per_tick` is the net growth of GC-tracked objects
+over the timed run, divided by the tick count (there is no per-allocation
+counter in the interpreters we run on).
+"""
+
+import gc
+import sys
+import time
+import json
+from timeit import default_timer
+from optparse import OptionParser
+
+from core.basis import Context
+from core.interfacing import Outputter, OutputBackend
+from lib.chains import Assembler, Transposer, Ranger, Indexer, Selector
+from lib.pulses import Sprayer, Cycler
+
+class CountingSink(OutputBackend):
+    """
+    Stand-in for the Max object: just counts the messages sent to it.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def outletHigh(self, outlet, args):
+        self.count += 1
+
+def player(c, sink, pitches, pattern):
+    """
+    Common tail for the graphs below: cycle `pattern` with the clock,
+    and on each of its values step through `pitches` and emit a note.
+    """
+    outputter = Outputter(sink, c, 0, 100, 100)
+    triggerPitch = Cycler(c, pitches, outputter.pitch, firstIf=1, nextIf='..', loopIf='..')
+    fan = Sprayer(c, triggerPitch, outputter.emit)
+    return Cycler(c, pattern, fan, firstIf=0, nextIf='..', loopIf='..')
+
+def tangram(c, sink, **kw):
+    """
+    The "Tangram" graph, as in main.py.
+    """
+    outputter = Outputter(sink, c, 0, 0, 100)
+
+    random_1 = Transposer(c, Ranger(c, 127), 1)
+
+    P0 = Assembler(c, 59, 61, 64, 54, 66)
+    P1 = Transposer(c, P0, 7)
+    P2 = Transposer(c, P0, 12)
+    P = Assembler(c, P0, P1, P2)
+
+    prefix_1 = Assembler(c, '111.00..')
+    prefix_2 = Assembler(c, '1.1100..')
+    prefix = Selector(c, Ranger(c, 3), prefix_1, prefix_1, prefix_2)
+
+    tail_1 = Assembler(c, '0.0..00.', '00000.1.', '0.0..10.')
+    tail_2 = Assembler(c, '0.0...0.', '1..00...', '0.0..00.')
+    tail = Selector(c, Ranger(c, 2), tail_1, tail_2)
+
+    inputPatt = Assembler(c, prefix, tail)
+    velocities = Assembler(c, 120, 80, random_1)
+
+    triggerPitch = Cycler(c, P, outputter.pitch, firstIf=1, nextIf='..', loopIf='..')
+    triggerVelocity = Cycler(c, velocities, outputter.velocity, firstIf=1, nextIf='..', loopIf='..')
+    fan = Sprayer(c, triggerPitch, triggerVelocity, outputter.emit)
+
+    return Cycler(c, inputPatt, fan, firstIf=0, nextIf='..', loopIf='..')
+
+def transposers(c, sink, depth=100, **kw):
+    """
+    A stack of `depth` Transposers over a short random chain.
+    """
+    chain = Ranger(c, [8, 12])
+    for i in range(depth):
+        chain = Transposer(c, chain, 1)
+    return player(c, sink, chain, '1011')
+
+def assemblers(c, sink, width=100, **kw):
+    """
+    One Assembler with `width` children, alternating constants
+    and random chains.
+    """
+    parts = []
+    for i in range(width):
+        if i % 2 == 0:
+            parts.append([60, None, 64])
+        else:
+            parts.append(Ranger(c, [3, 12]))
+    return player(c, sink, Assembler(c, *parts), '1111')
+
+def selectors(c, sink, width=16, **kw):
+    """
+    Random Selectors choosing between random chains, feeding
+    both the pitches and the trigger pattern.
+    """
+    choices = [Ranger(c, [4 + i % 4, 24]) for i in range(width)]
+    pitches = Selector(c, Ranger(c, width), *choices)
+    pattern = Selector(c, Ranger(c, 2), '1.1.', Ranger(c, [4, 2]))
+    return player(c, sink, Transposer(c, pitches, 48), pattern)
+
+def indexers(c, sink, length=1000, **kw):
+    """
+    An Indexer over a long constant table, with random indices.
+    """
+    table = Assembler(c, [(i * 7) % 128 for i in range(length)])
+    indices = Ranger(c, [16, length])
+    return player(c, sink, Indexer(c, table, indices), '1111')
+
+GRAPHS = [('tangram', tangram),
+          ('transposers', transposers),
+          ('assemblers', assemblers),
+          ('selectors', selectors),
+          ('indexers', indexers)]
+
+def percentile(ordered, p):
+    if not ordered: return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+def measure(name, factory, ticks, warmup, params):
+    """
+    Build a graph, run `warmup` untimed ticks then `ticks` timed ones,
+    and return a dictionary of results.
+    """
+    c = Context()
+    sink = CountingSink()
+    root = factory(c, sink, **params)
+
+    for i in xrange(warmup):
+        c.tick()
+        root.fire(i % 1024)
+        c.settle()
+
+    latencies = []
+    gc.collect()
+    gcWasEnabled = gc.isenabled()
+    gc.disable()
+    objectsBefore = len(gc.get_objects())
+    sink.count = 0
+
+    try:
+        for i in xrange(warmup, warmup + ticks):
+            t0 = default_timer()
+            c.tick()
+            root.fire(i % 1024)
+            c.settle()
+            latencies.append(default_timer() - t0)
+        objectsAfter = len(gc.get_objects())
+    finally:
+        if gcWasEnabled: gc.enable()
+
+    total = sum(latencies)
+    latencies.sort()
+    return {'graph': name,
+            'params': params,
+            'ticks': ticks,
+            'events': sink.count,
+            'ticks_per_sec': (ticks / total) if total > 0 else None,
+            'p50_us': percentile(latencies, 0.50) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6,
+            'max_us': latencies[-1] * 1e6 if latencies else 0.0,
+            'objects_per_tick': float(objectsAfter - objectsBefore) / max(ticks, 1)}
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-t', '--ticks', type='int', default=5000,
+                      help="timed ticks per graph (default %default)")
+    parser.add_option('-w', '--warmup', type='int', default=100,
+                      help="untimed ticks before measuring (default %default)")
+    parser.add_option('-g', '--graph', action='append', dest='graphs',
+                      help="graph to run (repeatable): " + ", ".join([n for (n, _) in GRAPHS]))
+    parser.add_option('--depth', type='int', default=100, help="Transposer stack depth")
+    parser.add_option('--width', type='int', default=100, help="Assembler width")
+    parser.add_option('--choices', type='int', default=16, help="Selector choices")
+    parser.add_option('--length', type='int', default=1000, help="Indexer table length")
+    parser.add_option('-o', '--output', help="write JSON here instead of stdout")
+    (options, args) = parser.parse_args(argv)
+
+    known = dict(GRAPHS)
+    names = options.graphs or [n for (n, _) in GRAPHS]
+    for n in names:
+        if n not in known: parser.error("unknown graph: " + n)
+
+    params = {'tangram': {},
+              'transposers': {'depth': options.depth},
+              'assemblers': {'width': options.width},
+              'selectors': {'width': options.choices},
+              'indexers': {'length': options.length}}
+
+    results = [measure(n, known[n], options.ticks, options.warmup, params[n])
+               for n in names]
+    report = {'python': sys.version.split()[0],
+              'platform': sys.platform,
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'results': results}
+
+    out = sys.stdout
+    if options.output: out = open(options.output, 'w')
+    try:
+        out.write(json.dumps(report, indent=2, sort_keys=True))
+        out.write('\n')
+    finally:
+        if options.output: out.close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
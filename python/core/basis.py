@@ -1,35 +1,318 @@
 """
 Basic chain and pulse functionality. It's here that we
-do the occurs-check and make the chains idempotent (i.e.
-returning the same value whenever examined in a single
-call into the system).
+make the chains idempotent (i.e. returning the same value
+whenever examined in a single call into the system); the
+occurs-check is `core.graph.finalize`.
 
 $Id: basis.py,v 8377d61c2922 2011/03/19 22:35:25 nick $
 """
 
-from core.util import flatten
+from core.util import literal, flatten
+from collections import deque
 import random
 
+MASK = (1 << 64) - 1
+GOLDEN = 0x9E3779B97F4A7C15
+
+def mix64(x):
+    """
+    The SplitMix64 finaliser: a bijective scrambling of 64-bit values.
+    """
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+def absorb(h, v):
+    return mix64(((h ^ (v & MASK)) + GOLDEN) & MASK)
+
+def stream(seed, tick, key):
+    """
+    The base from which all random values for one node at one tick
+    are derived.
+    """
+    return absorb(absorb(seed & MASK, tick), key)
+
+def counterRandom(seed, tick, key, index):
+    """
+    A 64-bit random value, computed directly from its coordinates:
+    there's no generator state.
+    >>> counterRandom(1, 2, 3, 4) == counterRandom(1, 2, 3, 4)
+    True
+    >>> len(set([counterRandom(1, t, k, i) for t in range(4) for k in range(4) for i in range(4)]))
+    64
+    """
+    return absorb(stream(seed, tick, key), index)
+
 class Context:
-    def __init__(self):
+    """
+    The shared clock for a graph. Unless constructed with `fold=False`,
+    a context also folds static chains into constants as the graph is
+    built (see `core.derived.wrap`).
+
+    Random values come from a counter-based generator: the value for
+    a node (identified by a key from `newKey()`) and index within it,
+    at a given tick, depends only on those and on the context's seed.
+    Renders are therefore reproducible for a given `seed`, independent
+    of evaluation order, and can start at any tick (see `seek()`).
+    """
+    def __init__(self, fold=True, seed=None):
         self.__stamp = 0
+        self.__time = -1
+        self.__keys = 0
+        if seed is None: seed = random.getrandbits(64)
+        self.__seed = seed
+        self.__folding = fold
+        self.__folds = {}
+        self.__folded = []
+        self.__schedule = None
+        self.__deferred = []
+        self.__inputs = deque()
+        self.__holding = False
 
     def tick(self):
+        if not self.__holding: self.drain()
         self.__stamp += 1
+        self.__time += 1
+        if self.__schedule:
+            for chain in self.__schedule:
+                chain._Chain__setupInstance()
+
+    def post(self, fn, *args):
+        """
+        Call `fn(*args)` at the start of the next tick. This is how input
+        from other threads (MIDI in, UI) should reach the graph: posting
+        takes no lock, and each tick sees the input as of its start.
+
+        >>> from lib.chains import Atom
+        >>> c = Context()
+        >>> a = Atom(c, default=1)
+        >>> c.post(a.set, 2)
+        >>> c.tick()
+        >>> c.post(a.set, 3)
+        >>> print a
+        [2]
+        >>> c.tick()
+        >>> print a
+        [3]
+        """
+        self.__inputs.append((fn, args))
+
+    def pending(self):
+        """
+        Whether there's posted input not yet applied.
+        """
+        return len(self.__inputs) > 0
+
+    def drain(self):
+        """
+        Apply the posted input now.
+        """
+        inputs = self.__inputs
+        while inputs:
+            (fn, args) = inputs.popleft()
+            fn(*args)
+
+    def hold(self, holding):
+        """
+        Stop (or restart) tick() applying posted input; something else
+        then calls drain() (as core.lookahead.Lookahead does).
+        """
+        self.__holding = holding
+
+    def defer(self, pulse):
+        """
+        Have `settle()` settle this pulse.
+        """
+        self.__deferred.append(pulse)
+
+    def settle(self):
+        """
+        Fire the pulses with the LAST policy, once each, with the last
+        value they were fired with this tick. Call this after firing the
+        root for the tick (`core.render.render` does).
+        """
+        while self.__deferred:
+            deferred = self.__deferred
+            self.__deferred = []
+            for pulse in deferred: pulse.settle()
+
+    def schedule(self, order):
+        """
+        Evaluate these chains, in this order, at the start of every tick
+        (see `core.graph.finalize`); or stop, given None. Chains then
+        find their sources already up to date, however deep the graph.
+
+        >>> from core.graph import finalize
+        >>> from lib.chains import Transposer, Ranger
+        >>> c = Context(fold=False, seed=1)
+        >>> deep = Ranger(c, 3)
+        >>> for i in range(5000): deep = Transposer(c, deep, 1)
+        >>> c.schedule(finalize(deep))
+        >>> c.tick()
+        >>> deep[0] >= 5000
+        True
+        """
+        self.__schedule = order
 
     def get(self):
         return self.__stamp
 
-    def rand(self, lim):
-        return random.randint(0, lim - 1)
+    def now(self):
+        """
+        The current tick: 0 after the first call to tick().
+        """
+        return self.__time
+
+    def seek(self, tick):
+        """
+        Make the next call to tick() start tick number `tick`. Random
+        chains are then exactly as they would have been after running
+        through all the earlier ticks.
+        >>> from lib.chains import Ranger
+        >>> a = Context(seed=42)
+        >>> r = Ranger(a, [4, 100])
+        >>> for t in range(10): a.tick()
+        >>> b = Context(seed=42)
+        >>> s = Ranger(b, [4, 100])
+        >>> b.seek(9)
+        >>> b.tick()
+        >>> (b.now(), r.values() == s.values())
+        (9, True)
+        """
+        self.__time = tick - 1
+
+    def seed(self):
+        return self.__seed
+
+    def newKey(self):
+        """
+        A key for a node which needs random values: keys are handed
+        out in order of construction.
+        """
+        self.__keys += 1
+        return self.__keys
+
+    def rand(self, lim, key, index):
+        """
+        A random value from 0 to lim-1 for a node and index, at the
+        current tick.
+        >>> a = Context(seed=99)
+        >>> b = Context(seed=99)
+        >>> [a.rand(100, 1, i) for i in range(5)] == [b.rand(100, 1, i) for i in range(5)]
+        True
+        >>> a.rand(100, 1, 0) == a.rand(100, 1, 0)
+        True
+        >>> a.rand(1000000, 1, 0) == a.rand(1000000, 2, 0)
+        False
+        """
+        return int(counterRandom(self.__seed, self.__time, key, index) % lim)
+
+    def rands(self, lim, key, n):
+        """
+        Random values from 0 to lim-1 for indices 0 to n-1 of a node.
+        >>> c = Context(seed=7)
+        >>> c.tick()
+        >>> c.rands(50, 3, 4) == [c.rand(50, 3, i) for i in range(4)]
+        True
+        """
+        # This is absorb(), inlined: it's the inner loop of every Ranger.
+        base = stream(self.__seed, self.__time, key)
+        result = []
+        for i in xrange(n):
+            x = ((base ^ i) + GOLDEN) & MASK
+            x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+            x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+            result.append(int((x ^ (x >> 31)) % lim))
+        return result
+
+    def getState(self):
+        """
+        The state which determines future output (other than that held
+        in the nodes themselves): since the random values are computed
+        from the tick, that's just the tick.
+        >>> c = Context(seed=1)
+        >>> c.tick()
+        >>> s = c.getState()
+        >>> c.tick()
+        >>> x = c.rands(1000, 1, 3)
+        >>> c.setState(s)
+        >>> c.tick()
+        >>> c.rands(1000, 1, 3) == x
+        True
+        """
+        return self.__time
+
+    def setState(self, state):
+        self.__time = state
+
+    def folding(self):
+        return self.__folding
+
+    def fold(self, chain):
+        """
+        Return a Const holding the value of a static chain, noting the
+        fold. Each chain is only folded once.
+        >>> context = Context()
+        >>> c = Const(context, '1.2')
+        >>> f = context.fold(c)
+        >>> print f
+        [1 . 2]
+        >>> context.fold(c) is f
+        True
+        >>> context.folded() == [c]
+        True
+        """
+        if chain not in self.__folds:
+            # Not interned: computed values aren't source literals, and
+            # should go when the graph does.
+            self.__folds[chain] = Const(self, list(chain.values()), shared=False)
+            self.__folded.append(chain)
+        return self.__folds[chain]
+
+    def folded(self):
+        """
+        The chains which have been folded, in the order of folding.
+        """
+        return list(self.__folded)
 
-class Chain:
+class Chain(object):
     """
     A Chain is a list of numeric values or 'empty' slots.
+
+    Instances are cached per context stamp, and rebuilt only when
+    needed. A VOLATILE chain (which, not knowing any better, includes
+    an arbitrary subclass) is rebuilt on every new stamp. Any other
+    chain is rebuilt when one of its sources() has changed, or when
+    it has been invalidate()d; if it isn't MUTABLE either, and all of
+    its sources are static, it's static: it is built exactly once.
+
+    A LAZY chain also provides `lazyLength()` and `lazyItem(k)`, which
+    compute its length, or one element, from its sources without
+    building the whole instance. `length()` and `[k]` use them when the
+    cached instance isn't known to be current, and the chain was last
+    seen to be at least LAZY_MIN long: for short chains, building the
+    instance once a tick is cheaper than answering each access lazily.
     """
+    __slots__ = ('__context', '__lastStamp', '__instance', '__stale', '__version',
+                 '__sourceVersions', '__static', '__edits', '__lazyStamp', '__lazyLength',
+                 '__dict__')
+
+    VOLATILE = True
+    MUTABLE = True
+    LAZY = False
+    LAZY_MIN = 64
+
     def __init__(self, context):
         self.__context = context
         self.__lastStamp = -1
+        self.__instance = None
+        self.__stale = True
+        self.__version = 0
+        self.__sourceVersions = None
+        self.__static = None
+        self.__edits = 0
+        self.__lazyStamp = None
+        self.__lazyLength = None
 
     def instance(self):
         """
@@ -37,6 +320,103 @@ class Chain:
         """
         return []
 
+    def sources(self):
+        """
+        The chains this one is computed from.
+        """
+        return []
+
+    def dependencies(self):
+        """
+        The chains this one currently depends on: by default all of its
+        sources, but (for instance) a Selector only depends on its index
+        and the chain that it is currently selecting.
+        """
+        return self.sources()
+
+    def isStatic(self):
+        """
+        Can this chain's value never change?
+        >>> Chain(None).isStatic()
+        False
+        >>> Const(None, [1, 2]).isStatic()
+        True
+        """
+        if self.__static is None:
+            self.__static = not self.MUTABLE
+            for s in self.sources():
+                if not s.isStatic(): self.__static = False
+        return self.__static
+
+    def invalidate(self):
+        """
+        Force a rebuild on the next access (for chains whose state
+        is changed from outside, such as MIDI input).
+        >>> from const import C
+        >>> context = C(get=Mock('get', returns_iter=[1, 2, 3]))
+        >>> c = Chain(context)
+        >>> c.VOLATILE = False
+        >>> c.instance = Mock('instance', returns_iter=[[1], [2]])
+        >>> c[0]
+        Called get()
+        Called instance()
+        1
+        >>> c[0]
+        Called get()
+        1
+        >>> c.invalidate()
+        >>> c[0]
+        Called get()
+        Called instance()
+        2
+        >>> c.edits()
+        1
+        """
+        self.__stale = True
+        self.__lazyStamp = None
+        self.__edits += 1
+
+    def edits(self):
+        """
+        The number of times this chain has been invalidated.
+        """
+        return self.__edits
+
+    def version(self):
+        """
+        A counter which increases whenever this chain's value changes.
+        >>> from const import C
+        >>> context = C(get=Mock('get', returns_iter=[1, 2, 3]))
+        >>> c = Chain(context)
+        >>> c.instance = Mock('instance', returns_iter=[[1], [1], [2]])
+        >>> c.version()
+        Called get()
+        Called instance()
+        1
+        >>> c.version()
+        Called get()
+        Called instance()
+        1
+        >>> c.version()
+        Called get()
+        Called instance()
+        2
+        """
+        self.__setupInstance()
+        return self.__version
+
+    def __sourcesChanged(self):
+        if self.__static or self.isStatic(): return False
+        versions = []
+        for s in self.dependencies():
+            s.__setupInstance()
+            versions.append(s.__version)
+        if versions != self.__sourceVersions:
+            self.__sourceVersions = versions
+            return True
+        else:
+            return False
+
     def __setupInstance(self):
         """ Get a new instance, if needed for a new timestamp.
         >>> from const import C
@@ -51,12 +431,47 @@ class Chain:
         """
         stamp = self.__context.get()
         if stamp != self.__lastStamp:
-            self.__instance = self.instance()
             self.__lastStamp = stamp
+            if self.VOLATILE or self.__sourcesChanged():
+                self.__stale = True
+
+        if self.__stale:
+            self.__stale = False
+            if self.refresh(): self.__version += 1
+
+    def refresh(self):
+        """
+        Rebuild the cached value from instance(), returning whether it
+        has changed. (Chains which cache their value in another form,
+        such as those in lib.vectors, override this.)
+        """
+        instance = tuple(self.instance())
+        changed = instance != self.__instance
+        self.__instance = instance
+        return changed
+
+    def __lazyStampNow(self):
+        """
+        The current stamp, if this chain should answer lazily: it's LAZY
+        and long enough, and its instance isn't known to be current
+        (without looking at its sources); otherwise None.
+        """
+        if not self.LAZY: return None
+        if self.__lazyLength is not None:
+            known = self.__lazyLength
+        elif self.__instance is not None:
+            known = len(self.__instance)
+        else:
+            return None
+        if known < self.LAZY_MIN: return None
+        stamp = self.__context.get()
+        if self.__stale or (stamp != self.__lastStamp and not self.isStatic()):
+            return stamp
+        else:
+            return None
 
     def length(self):
         """
-        TODO: occurs-check.
         >>> from const import C
         >>> context = C(get=Mock('get', returns=1))
         >>> c = Chain(context)
@@ -70,9 +485,37 @@ class Chain:
         2
         >>> 
         """
+        stamp = self.__lazyStampNow()
+        if stamp is not None:
+            if self.__lazyStamp != stamp:
+                self.__lazyLength = self.lazyLength()
+                self.__lazyStamp = stamp
+            return self.__lazyLength
+
         self.__setupInstance()
         return len(self.__instance)
 
+    def values(self):
+        """
+        The whole chain as an immutable tuple. This is the cached instance
+        itself, so there's no copying; prefer it to element-by-element
+        access when a chain is needed in full.
+        >>> from const import C
+        >>> context = C(get=Mock('get', returns=1))
+        >>> c = Chain(context)
+        >>> c.instance = Mock('instance', returns=[1, None, 3])
+        >>> c.values()
+        Called get()
+        Called instance()
+        (1, None, 3)
+        >>> c.values() is c.values()
+        Called get()
+        Called get()
+        True
+        """
+        self.__setupInstance()
+        return self.__instance
+
     def __getitem__(self, key):
         """
         >>> from const import C
@@ -98,8 +541,13 @@ class Chain:
         Called instance()
         5        
         """
+        if key < 0: return None
+        if self.__lazyStampNow() is not None:
+            if key >= self.length(): return None
+            return self.lazyItem(key)
+
         self.__setupInstance()
-        if key < 0 or key >= len(self.__instance):
+        if key >= len(self.__instance):
             return None
         else:
             return self.__instance[key]
@@ -116,9 +564,8 @@ class Chain:
         Called instance()
         [1 3 . -5]
         """
-        self.__setupInstance()
         result = "["
-        for v in self.__instance:
+        for v in self.values():
             if result != "[": result += " "
             if v is None:
                 result += '.'
@@ -127,16 +574,150 @@ class Chain:
         result += "]"
         return result
 
-class Pulse:
+class Pulse(object):
     '''
     A Pulse consumes incoming integer values in real time.
+
+    How often it acts on being fired within one tick is set by its
+    policy (the class's POLICY, or `setPolicy`):
+
+        EVERY       every time (the default)
+        ONCE        the first time only
+        COALESCE    once for each distinct value
+        LAST        once, with the last value, when the context settles
+                    (see `Context.settle`)
     '''
+    __slots__ = ('__context', '__policy', '__stamp', '__fired', '__dict__')
+
+    EVERY = 'every'
+    ONCE = 'once'
+    COALESCE = 'coalesce'
+    LAST = 'last'
+
+    POLICY = EVERY
+
     def __init__(self, context):
         self.__context = context
+        self.__policy = self.POLICY
+        self.__stamp = None
+        self.__fired = None
+
+    def setPolicy(self, policy):
+        """
+        >>> context = Context()
+        >>> p = Pulse(context)
+        >>> p.doFire = Mock('doFire')
+        >>> p.setPolicy(Pulse.ONCE)
+        >>> context.tick()
+        >>> p.fire(1); p.fire(2)
+        Called doFire(1)
+        >>> context.tick()
+        >>> p.fire(3)
+        Called doFire(3)
+
+        >>> p.setPolicy(Pulse.COALESCE)
+        >>> context.tick()
+        >>> p.fire(1); p.fire(2); p.fire(1)
+        Called doFire(1)
+        Called doFire(2)
+
+        >>> p.setPolicy(Pulse.LAST)
+        >>> context.tick()
+        >>> p.fire(1); p.fire(2)
+        >>> context.settle()
+        Called doFire(2)
+        >>> context.settle()
+
+        >>> p.setPolicy('sometimes')
+        Traceback (most recent call last):
+            ...
+        ValueError: sometimes
+        """
+        if policy not in [Pulse.EVERY, Pulse.ONCE, Pulse.COALESCE, Pulse.LAST]:
+            raise ValueError(policy)
+        self.__policy = policy
+        self.__stamp = None
+        self.__fired = None
+
+    def policy(self):
+        return self.__policy
+
+    def sources(self):
+        """
+        The chains this pulse reads.
+        """
+        return []
+
+    def targets(self):
+        """
+        The pulses this one fires (or otherwise reads).
+        """
+        return []
 
     def fire(self, i):
-        """ TODO: occurs-check, idempotence etc. """
-        self.doFire(i)
+        """ The occurs-check is `core.graph.finalize`. """
+        policy = self.__policy
+        if policy is Pulse.EVERY:
+            self.doFire(i)
+            return
+
+        stamp = self.__context.get()
+        if stamp != self.__stamp:
+            self.__stamp = stamp
+            self.__fired = None
+
+        if policy is Pulse.ONCE:
+            if self.__fired is None:
+                self.__fired = True
+                self.doFire(i)
+        elif policy is Pulse.COALESCE:
+            if self.__fired is None: self.__fired = set()
+            if i not in self.__fired:
+                self.__fired.add(i)
+                self.doFire(i)
+        else:
+            # Deferred whenever there's nothing pending, so that a pulse
+            # fired again after settling (by another LAST pulse) settles
+            # again:
+            if self.__fired is None: self.__context.defer(self)
+            self.__fired = (i,)
+
+    def settle(self):
+        """
+        Act on a deferred (LAST) firing.
+
+        >>> context = Context()
+        >>> class Forward(Pulse):
+        ...     def __init__(self, target, fired):
+        ...         Pulse.__init__(self, context)
+        ...         self.setPolicy(Pulse.LAST)
+        ...         (self.target, self.fired) = (target, fired)
+        ...     def doFire(self, i):
+        ...         self.fired.append(i)
+        ...         if self.target is not None: self.target.fire(i * 10)
+        >>> fired = []
+        >>> b = Forward(None, fired)
+        >>> a = Forward(b, [])
+        >>> context.tick()
+        >>> b.fire(1); a.fire(2)
+        >>> context.settle()
+        >>> fired
+        [1, 20]
+        """
+        if self.__fired is not None:
+            (i,) = self.__fired
+            self.__fired = None
+            self.doFire(i)
+
+    def getState(self):
+        """
+        Any state carried from one fire to the next (such as a counter),
+        so that evaluation can be rolled back.
+        """
+        return None
+
+    def setState(self, state):
+        pass
 
     def doFire(self, i):
         '''
@@ -148,11 +729,27 @@ class Const(Chain):
     """
     A chain built from a (recursive) list, a string, or an int.
     It's here because a pervasive function (wrap)
-    refers to it.
+    refers to it. Its values are an interned tuple (see
+    core.util.literal), shared by every Const with the same values,
+    unless `shared` is False.
+
+    >>> context = Context()
+    >>> Const(context, '1.1').values() is Const(context, [1, None, 1]).values()
+    True
+    >>> Const(context, [1, 2], shared=False).values() is Const(context, [1, 2]).values()
+    False
     """
-    def __init__(self, context, v):
+    __slots__ = ('__values',)
+
+    VOLATILE = False
+    MUTABLE = False
+
+    def __init__(self, context, v, shared=True):
         Chain.__init__(self, context)
-        self.__values = flatten(v)
+        if shared:
+            self.__values = literal(v)
+        else:
+            self.__values = tuple(flatten(v))
 
     def instance(self):
         """
@@ -178,7 +775,6 @@ class Const(Chain):
         True
 
         >>> c[-5] is None
-        Called get()
         True
 
         >>> c = Const(context, [5, '1.1'])
@@ -0,0 +1,89 @@
+"""
+Batch rendering: render many variations of one graph (different random
+seeds and parameters) in a pool of processes.
+
+A graph factory is a function `factory(context, maxObject, **params)`
+which builds a graph, with its Outputters talking to `maxObject`, and
+returns its root pulse. Factories (and summary functions) are sent to
+the worker processes, so they must be defined at module level.
+"""
+
+from core.basis import Context
+from core.render import EventBuffer, render
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+def renderVariation(factory, seed, params, ticks, summarise=None, wrap=None):
+    """
+    Build and render one variation in this process, returning its
+    EventBuffer (or whatever `summarise` makes of it).
+    >>> from testgraphs import melody
+    >>> buf = renderVariation(melody, 7, {}, 64)
+    >>> len(buf) > 0
+    True
+    >>> list(buf.events()) == list(renderVariation(melody, 7, {}, 64).events())
+    True
+    """
+    context = Context(seed=seed)
+    sink = EventBuffer()
+    root = factory(context, sink, **params)
+    render(context, root, sink, ticks, wrap=wrap)
+    if summarise is None:
+        return sink
+    else:
+        return summarise(sink)
+
+def _renderJob(job):
+    return renderVariation(*job)
+
+def renderBatch(factory, seeds, ticks, overrides=None,
+                summarise=None, wrap=None, processes=None, chunksize=8):
+    """
+    Render every combination of seed and parameter overrides (a list of
+    keyword dictionaries for the factory) for `ticks` ticks. Returns a
+    list of (seed, params, result) tuples, in order: parameters outer,
+    seeds inner. `processes` is the pool size (default: one per CPU);
+    with 0, or where there's no multiprocessing, everything is rendered
+    in this process.
+    >>> from testgraphs import melody, events
+    >>> serial = renderBatch(melody, [1, 2, 1], 100, summarise=events, processes=0)
+    >>> pooled = renderBatch(melody, [1, 2, 1], 100, summarise=events, processes=2)
+    >>> serial == pooled
+    True
+    >>> [(seed, params) for (seed, params, _) in pooled]
+    [(1, {}), (2, {}), (1, {})]
+    >>> serial[0][2] == serial[2][2], serial[0][2] == serial[1][2]
+    (True, False)
+    >>> [(p, seed) for (seed, p, _) in renderBatch(melody, [5], 10,
+    ...                                            overrides=[{'length': 2}, {'length': 3}],
+    ...                                            summarise=len, processes=0)]
+    [({'length': 2}, 5), ({'length': 3}, 5)]
+    """
+    if overrides is None: overrides = [{}]
+    jobs = [(factory, seed, params, ticks, summarise, wrap)
+            for params in overrides for seed in seeds]
+
+    if processes == 0 or multiprocessing is None:
+        results = [_renderJob(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_renderJob, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [(seed, params, result)
+            for ((_, seed, params, _, _, _), result) in zip(jobs, results)]
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,323 @@
+"""
+A standalone clock, for running graphs outside Max (as a headless
+service, or for load testing): it does what Max's `clock(i)` calls do,
+at a given tempo, for any number of independent contexts.
+
+    driver = ClockDriver()
+    driver.add(Player(c, input, bpm=120, ppq=8, wrap=16))
+    driver.add(Player(c2, input2, bpm=90))
+    driver.run()
+
+Ticks are scheduled against absolute deadlines (start + n * period) on
+a monotonic clock, so lateness in one tick doesn't accumulate as drift.
+A tick which starts more than `tolerance` seconds after its deadline is
+counted as late (and reported to `onLate`, if given); ticks missed
+entirely are still run, in order, to catch up, unless the player is more
+than `skipAfter` seconds behind, in which case the missed ticks are
+skipped (and counted).
+
+The monotonic clock is time.monotonic where there is one, System.nanoTime
+under Jython, or clock_gettime(CLOCK_MONOTONIC) on Linux; failing those,
+MONOTONIC is False and wall-clock time is used, so that a change to the
+system clock will shift deadlines.
+"""
+
+import heapq
+import sys
+import threading
+import time
+
+def findMonotonic():
+    """
+    A monotonic clock in seconds, or None if we can't find one.
+    """
+    try:
+        from time import monotonic
+        return monotonic
+    except ImportError:
+        pass
+
+    try:
+        from java.lang import System
+        return lambda: System.nanoTime() / 1e9
+    except ImportError:
+        pass
+
+    if not sys.platform.startswith('linux'): return None
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        CLOCK_MONOTONIC = 1     # Linux.
+        lib = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+                          use_errno=True)
+        clock_gettime = lib.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            ts = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                raise OSError(ctypes.get_errno(), "clock_gettime failed")
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+
+        monotonic()
+        return monotonic
+    except (ImportError, AttributeError, TypeError, OSError):
+        return None
+
+monotonic = findMonotonic()
+MONOTONIC = monotonic is not None
+if not MONOTONIC: monotonic = time.time
+
+class Player:
+    """
+    One graph, driven at `bpm` with `ppq` ticks to the beat. The clock
+    count passed to the root pulse goes up from 0 (modulo `wrap`, if
+    given, like the Max-side divider). `sink`, if given, is told the
+    tick and flushed, as in core.render.
+    """
+    def __init__(self, context, pulse, bpm=120, ppq=8, wrap=None, sink=None):
+        self.context = context
+        self.pulse = pulse
+        self.wrap = wrap
+        self.sink = sink
+        self.ticks = 0
+        self.late = 0
+        self.skipped = 0
+        self.maxLateness = 0.0
+        self.setTempo(bpm, ppq)
+
+    def setTempo(self, bpm, ppq=None):
+        if ppq is not None: self.ppq = ppq
+        self.bpm = bpm
+        self.period = 60.0 / (bpm * self.ppq)
+
+    def clock(self, n):
+        if self.sink is not None: self.sink.setTick(n)
+        self.context.tick()
+        if self.wrap is None:
+            self.pulse.fire(n)
+        else:
+            self.pulse.fire(n % self.wrap)
+        self.context.settle()
+        if self.sink is not None: self.sink.flush()
+
+class ClockDriver:
+    """
+    Runs players against deadlines on one thread. `now` and `sleep` can
+    be replaced (for testing, or to follow another clock).
+
+    >>> from core.basis import Context
+    >>> from core.render import EventBuffer
+    >>> from core.interfacing import Outputter
+    >>> from lib.pulses import Cycler, Sprayer
+    >>> fake = FakeTime()
+    >>> driver = ClockDriver(now=fake.now, sleep=fake.sleep)
+
+    Two graphs, at different tempi:
+
+    >>> def graph(buf):
+    ...     c = Context(seed=1)
+    ...     out = Outputter(buf, c, 0, 100, 50)
+    ...     return (c, Cycler(c, '3456', Sprayer(c, out.pitch, out.emit), firstIf=0, nextIf='..', loopIf='..'))
+    >>> (a, b) = (EventBuffer(), EventBuffer())
+    >>> pa = driver.add(Player(*graph(a), bpm=120, ppq=4, wrap=4, sink=a))
+    >>> pb = driver.add(Player(*graph(b), bpm=60, ppq=4, sink=b))
+    >>> driver.run(until=2.0)
+    >>> pa.ticks, pb.ticks, list(a.pitches)
+    (16, 8, [3, 4, 5, 6, 3, 4, 5, 6, 3, 4, 5, 6, 3, 4, 5, 6])
+    >>> [round(t, 3) for t in fake.wakeups[:5]]
+    [0.125, 0.25, 0.375, 0.5, 0.625]
+
+    A slow tick makes the ones after it late, but doesn't shift the
+    ones after that:
+
+    >>> driver.remove(pb)
+    >>> slow = Player(*graph(EventBuffer()), bpm=120, ppq=4)
+    >>> realClock = slow.clock
+    >>> def clock(n):
+    ...     if n == 2: fake.t += 0.3
+    ...     realClock(n)
+    >>> slow.clock = clock
+    >>> lates = []
+    >>> driver = ClockDriver(now=fake.now, sleep=fake.sleep, onLate=lambda p, n, x: lates.append(n))
+    >>> driver.add(slow) is slow
+    True
+    >>> driver.run(until=fake.t + 1.0)
+    >>> slow.ticks, lates, slow.late
+    (8, [3, 4], 2)
+    >>> [round(t - slow.start, 3) for t in fake.wakeups[-3:]]
+    [0.625, 0.75, 0.875]
+
+    After a long stall, the missed ticks are skipped rather than all run
+    at once; the clock count still follows the time:
+
+    >>> buf = EventBuffer()
+    >>> stalled = driver.add(Player(*graph(buf), bpm=120, ppq=4, sink=buf))
+    >>> driver.step() is not None
+    True
+    >>> fake.t += 3600
+    >>> wait = driver.step()
+    >>> stalled.ticks, stalled.skipped, list(buf.ticks)
+    (28801, 28799, [0, 28800])
+
+    Callbacks can change the driver:
+
+    >>> def retempo(player, n, lateness):
+    ...     driver.setTempo(player, 60)
+    ...     driver.remove(slow)
+    >>> driver = ClockDriver(now=fake.now, sleep=fake.sleep, onLate=retempo)
+    >>> p = driver.add(Player(*graph(EventBuffer()), bpm=120, ppq=4))
+    >>> slow = driver.add(Player(*graph(EventBuffer()), bpm=120, ppq=4))
+    >>> fake.t += 0.1
+    >>> driver.run(until=fake.t + 2.0)
+    >>> p.ticks, slow.ticks, p.period
+    (9, 0, 0.25)
+    """
+    def __init__(self, now=monotonic, sleep=time.sleep, tolerance=0.002, skipAfter=1.0, onLate=None):
+        self.__now = now
+        self.__sleep = sleep
+        self.__tolerance = tolerance
+        self.__skipAfter = skipAfter
+        self.__onLate = onLate
+        self.__heap = []
+        self.__sequence = 0
+        self.__lock = threading.Lock()
+        self.__running = False
+        self.__thread = None
+
+    def add(self, player, at=None):
+        """
+        Start a player, from time `at` (by default, now). Returns it.
+        """
+        if at is None: at = self.__now()
+        self.__lock.acquire()
+        try:
+            player.start = at
+            player.ticks = 0
+            self.__push(at, player)
+        finally:
+            self.__lock.release()
+        return player
+
+    def remove(self, player):
+        self.__lock.acquire()
+        try:
+            self.__remove(player)
+        finally:
+            self.__lock.release()
+
+    def __remove(self, player):
+        """
+        Take a player out of the heap; returns whether it was there.
+        """
+        n = len(self.__heap)
+        self.__heap = [e for e in self.__heap if e[2] is not player]
+        heapq.heapify(self.__heap)
+        return len(self.__heap) < n
+
+    def setTempo(self, player, bpm, ppq=None):
+        """
+        Change a player's tempo from its next tick on.
+        """
+        self.__lock.acquire()
+        try:
+            deadline = player.start + player.ticks * player.period
+            player.setTempo(bpm, ppq)
+            player.start = deadline - player.ticks * player.period
+            if self.__remove(player): self.__push(deadline, player)
+        finally:
+            self.__lock.release()
+
+    def __push(self, deadline, player):
+        self.__sequence += 1
+        heapq.heappush(self.__heap, (deadline, self.__sequence, player))
+
+    def step(self):
+        """
+        Run every tick now due, returning the time until the next
+        deadline (or None if there are no players). Players and
+        callbacks are run without the driver's lock held, so they can
+        add, remove or retime players.
+        """
+        while True:
+            self.__lock.acquire()
+            try:
+                if not self.__heap: return None
+                (deadline, _, player) = self.__heap[0]
+                now = self.__now()
+                if deadline > now:
+                    return deadline - now
+                heapq.heappop(self.__heap)
+                n = player.ticks
+                lateness = now - deadline
+                late = lateness > self.__tolerance
+                if late:
+                    player.late += 1
+                    if lateness > player.maxLateness: player.maxLateness = lateness
+                if lateness > self.__skipAfter:
+                    missed = int(lateness / player.period)
+                    player.skipped += missed
+                    n += missed
+                player.ticks = n + 1
+                self.__push(player.start + player.ticks * player.period, player)
+            finally:
+                self.__lock.release()
+
+            if late and self.__onLate is not None: self.__onLate(player, n, lateness)
+            player.clock(n)
+
+    def run(self, until=None):
+        """
+        Run until stop() is called, or there are no players; or, given
+        `until`, until the next tick is due at or after that time.
+        """
+        self.__running = True
+        while self.__running:
+            wait = self.step()
+            if wait is None: break
+            if until is not None and self.__now() + wait >= until: break
+            self.__sleep(wait)
+
+    def start(self):
+        """
+        Run on a background thread.
+        """
+        self.__thread = threading.Thread(target=self.run)
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+class FakeTime:
+    """
+    A clock which only moves when slept on, for testing; it records
+    the times it was woken at.
+    """
+    def __init__(self):
+        self.t = 0.0
+        self.wakeups = []
+
+    def now(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+        self.wakeups.append(self.t)
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -1,9 +1,11 @@
 from manifest import *
-from core.basis import Const
+from core.basis import Context, Chain, Const
 
 def wrap(context, item):
     """
-    Turn an item into a chain - including a Const.
+    Turn an item into a chain - including a Const. A static chain
+    (one built only from constants) is folded into a Const if the
+    context is folding.
     >>> wrap(None, 42)
     <core.basis.Const ...>
 
@@ -21,9 +23,30 @@ def wrap(context, item):
     >>> chain2[2]
     Called get()
     2
+
+    >>> from lib.chains import Assembler, Transposer, Ranger
+    >>> context = Context()
+    >>> p0 = Assembler(context, 1, 2)
+    >>> p1 = Transposer(context, p0, 12)
+    >>> f = wrap(context, p1)
+    >>> print f
+    [13 14]
+    >>> f.__class__ is Const
+    True
+    >>> context.folded() == [p0, p1]
+    True
+    >>> r = Transposer(context, Ranger(context, 10), 1)
+    >>> wrap(context, r) is r
+    True
+    >>> wrap(Context(fold=False), p1) is p1
+    True
     """
     if type(item) in [STRING_type, LIST_type, INTEGER_type, NONE_type]:
         return Const(context, item)
+    elif isinstance(item, Chain) and not isinstance(item, Const) \
+            and isinstance(context, Context) and context.folding() \
+            and item.isStatic():
+        return context.fold(item)
     else:
         return item
 
@@ -0,0 +1,132 @@
+"""
+Walking the graph of chains and pulses: reachability, the occurs-check,
+and evaluation of chains in dependency order.
+"""
+
+from core.basis import Chain, Pulse
+
+def neighbours(node):
+    """
+    The nodes which a chain or pulse refers to.
+    """
+    if isinstance(node, Pulse):
+        return node.sources() + node.targets()
+    elif isinstance(node, Chain):
+        return node.sources()
+    else:
+        return []
+
+def reachable(*roots):
+    """
+    Every chain and pulse reachable from the roots, each once,
+    in depth-first order.
+    >>> from core.basis import Context
+    >>> from core.interfacing import Outputter
+    >>> from lib.chains import Transposer, Ranger
+    >>> from lib.pulses import Cycler
+    >>> c = Context()
+    >>> out = Outputter(None, c, 0, 0, 0)
+    >>> root = Cycler(c, Transposer(c, Ranger(c, 10), 1), out.pitch)
+    >>> [n.__class__.__name__ for n in reachable(root)]
+    ['Cycler', 'Transposer', 'Ranger', 'Const', 'Const', 'Const', 'Const', 'Const', 'MidiIntHolder']
+    >>> len(reachable(root, root, out.emit))
+    12
+    """
+    seen = set()
+    result = []
+    stack = list(reversed(roots))
+    while stack:
+        node = stack.pop()
+        if id(node) in seen: continue
+        seen.add(id(node))
+        result.append(node)
+        stack.extend(reversed(neighbours(node)))
+    return result
+
+class CycleError(Exception):
+    """
+    A graph which refers to itself. `cycle` holds the nodes around the
+    loop, starting and ending with the same one.
+    """
+    def __init__(self, cycle):
+        Exception.__init__(self, " -> ".join([n.__class__.__name__ for n in cycle]))
+        self.cycle = cycle
+
+def finalize(*roots):
+    """
+    The occurs-check: raise CycleError if the graph from the roots
+    has a loop in it. Otherwise, return the chains in dependency order
+    (every chain after its sources), for `evaluate` or
+    `Context.schedule`. Neither check nor sort recurses.
+
+    >>> from core.basis import Context
+    >>> from lib.chains import Assembler, Transposer, Ranger
+    >>> from lib.pulses import Cycler
+    >>> c = Context(fold=False)
+    >>> r = Ranger(c, 10)
+    >>> t = Transposer(c, r, 1)
+    >>> [n.__class__.__name__ for n in finalize(Cycler(c, t, None))]
+    ['Const', 'Ranger', 'Const', 'Transposer', 'Const', 'Const', 'Const']
+
+    >>> a = Assembler(c, 1)
+    >>> t = Transposer(c, a, 1)
+    >>> a._Assembler__chains.append(t)
+    >>> finalize(Cycler(c, t, None))
+    Traceback (most recent call last):
+        ...
+    CycleError: Transposer -> Assembler -> Transposer
+    """
+    GREY, BLACK = 1, 2
+    state = {}
+    order = []
+    for root in roots:
+        if id(root) in state: continue
+        state[id(root)] = GREY
+        path = [root]
+        pending = [iter(neighbours(root))]
+        while pending:
+            for n in pending[-1]:
+                s = state.get(id(n))
+                if s is None:
+                    state[id(n)] = GREY
+                    path.append(n)
+                    pending.append(iter(neighbours(n)))
+                    break
+                elif s == GREY:
+                    start = [id(p) for p in path].index(id(n))
+                    raise CycleError(path[start:] + [n])
+            else:
+                pending.pop()
+                node = path.pop()
+                state[id(node)] = BLACK
+                order.append(node)
+    return [n for n in order if isinstance(n, Chain)]
+
+def evaluate(order):
+    """
+    Bring the chains (as ordered by `finalize`) up to date for the
+    current tick, sources first, so that no chain's evaluation has to
+    go further than its immediate sources.
+
+    >>> from core.basis import Context
+    >>> from lib.chains import Transposer, Ranger
+    >>> c = Context(fold=False, seed=1)
+    >>> deep = Ranger(c, [2, 10])
+    >>> for i in range(5000): deep = Transposer(c, deep, 1)
+    >>> order = finalize(deep)
+    >>> c.tick()
+    >>> evaluate(order)
+    >>> [v >= 5000 for v in deep.values()]
+    [True, True]
+    """
+    for chain in order:
+        chain._Chain__setupInstance()
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -8,18 +8,132 @@ from basis import Chain, Pulse
 
 class KeyboardChain(Chain):
     """
-    A chain which can hold the notes played/held on a keyboard. At present
-    the notes are only in chronological order, and we only hold the pitches.
-    Repeated notes are discarded.
-    (We might change this at some stage to have it encapsulate individual
-    chains for pitch and velocity.)
+    A chain which can hold the notes played/held on a keyboard: its
+    value is the held pitches, in the order played. Repeated notes are
+    discarded, as are pitches outside 0..127.
+
+    The notes are held in a 128-slot table (velocity per pitch) with a
+    linked list through it for the playing order, so that noteOn and
+    noteOff take constant time. `view()` and `velocities()` give chains
+    of the pitches, or their velocities, in the order played, ascending
+    or descending; like any other chain, they are only rebuilt when the
+    held notes change.
+
+    Called from a MIDI input thread, the note methods should go through
+    the context: `context.post(keyboard.noteOn, pitch, velocity)`. (This
+    also works under core.lookahead, which applies posted input at the
+    next clock.)
     """
+    __slots__ = ('__velocities', '__next', '__prev', '__views')
+
+    VOLATILE = False
+
+    PLAYED = 'played'
+    ASCENDING = 'ascending'
+    DESCENDING = 'descending'
+
+    # Index of the head of the (circular) list of held pitches:
+    HEAD = 128
+
     def __init__(self, context):
         Chain.__init__(self, context)
-        self.__pitches = []
+        self.__views = {}
+        self.__clear()
+
+    def __clear(self):
+        self.__velocities = [None] * 128
+        self.__next = [-1] * 129
+        self.__prev = [-1] * 129
+        self.__next[self.HEAD] = self.__prev[self.HEAD] = self.HEAD
+
+    def __changed(self):
+        # The views are invalidated directly, since a change of velocity
+        # alone need not change this chain's own value:
+        self.invalidate()
+        for v in self.__views.values(): v.invalidate()
+
+    def __held(self, pitch):
+        return 0 <= pitch < 128 and self.__prev[pitch] >= 0
+
+    def pitches(self, order=PLAYED):
+        """
+        The held pitches, as a list, in the given order.
+        >>> k = KeyboardChain(None)
+        >>> for p in [64, 60, 67, 200]: k.noteOn(p, p - 50)
+        >>> k.pitches(), k.pitches(KeyboardChain.ASCENDING), k.pitches(KeyboardChain.DESCENDING)
+        ([64, 60, 67], [60, 64, 67], [67, 64, 60])
+        """
+        if order == KeyboardChain.PLAYED:
+            result = []
+            nxt = self.__next
+            p = nxt[self.HEAD]
+            while p != self.HEAD:
+                result.append(p)
+                p = nxt[p]
+            return result
+        elif order == KeyboardChain.ASCENDING:
+            prev = self.__prev
+            return [p for p in xrange(128) if prev[p] >= 0]
+        elif order == KeyboardChain.DESCENDING:
+            prev = self.__prev
+            return [p for p in xrange(127, -1, -1) if prev[p] >= 0]
+        else:
+            raise ValueError(order)
+
+    def velocity(self, pitch):
+        """
+        The velocity of a held pitch (None if it isn't held).
+        """
+        if 0 <= pitch < 128:
+            return self.__velocities[pitch]
+        else:
+            return None
 
     def instance(self):
-        return self.__pitches
+        return self.pitches()
+
+    def view(self, order=PLAYED):
+        """
+        A chain of the held pitches in the given order (shared between
+        callers).
+        >>> from core.basis import Context
+        >>> c = Context()
+        >>> k = KeyboardChain(c)
+        >>> up = k.view(KeyboardChain.ASCENDING)
+        >>> vels = k.velocities(KeyboardChain.ASCENDING)
+        >>> k.view(KeyboardChain.ASCENDING) is up
+        True
+        >>> k.noteOn(67, 90); k.noteOn(60, 100)
+        >>> c.tick()
+        >>> print up, vels
+        [60 67] [100 90]
+        >>> c.tick()
+        >>> up.version(), vels.version()
+        (1, 1)
+        >>> k.noteOff(67)
+        >>> c.tick()
+        >>> print up, vels
+        [60] [100]
+        >>> k.noteOff(60); k.noteOn(60, 30)
+        >>> c.tick()
+        >>> print up, vels
+        [60] [30]
+        """
+        return self.__view(order, False)
+
+    def velocities(self, order=PLAYED):
+        """
+        A chain of the velocities of the held notes, parallel to `view(order)`.
+        """
+        return self.__view(order, True)
+
+    def __view(self, order, velocities):
+        if order not in [KeyboardChain.PLAYED, KeyboardChain.ASCENDING, KeyboardChain.DESCENDING]:
+            raise ValueError(order)
+        key = (order, velocities)
+        if key not in self.__views:
+            self.__views[key] = KeyboardView(self._Chain__context, self, order, velocities)
+        return self.__views[key]
 
     def noteOn(self, pitch, velocity):
         """
@@ -35,8 +149,15 @@ class KeyboardChain(Chain):
         Called get()
         72
         """
-        if not pitch in self.__pitches:
-            self.__pitches.append(pitch)
+        if 0 <= pitch < 128 and not self.__held(pitch):
+            (nxt, prev) = (self.__next, self.__prev)
+            last = prev[self.HEAD]
+            nxt[last] = pitch
+            prev[pitch] = last
+            nxt[pitch] = self.HEAD
+            prev[self.HEAD] = pitch
+            self.__velocities[pitch] = velocity
+            self.__changed()
 
     def noteOff(self, pitch):
         """
@@ -69,8 +190,13 @@ class KeyboardChain(Chain):
         Called get()
         {'a': None}
         """
-        if pitch in self.__pitches:
-            self.__pitches.remove(pitch)
+        if self.__held(pitch):
+            (nxt, prev) = (self.__next, self.__prev)
+            nxt[prev[pitch]] = nxt[pitch]
+            prev[nxt[pitch]] = prev[pitch]
+            nxt[pitch] = prev[pitch] = -1
+            self.__velocities[pitch] = None
+            self.__changed()
 
     def allNotesOff(self):
         """
@@ -83,7 +209,34 @@ class KeyboardChain(Chain):
         Called get()
         {'a': None}
         """
-        self.__pitches = []
+        self.__clear()
+        self.__changed()
+
+class KeyboardView(Chain):
+    """
+    The held pitches (or their velocities) of a KeyboardChain, in some
+    order: see `KeyboardChain.view()`. The keyboard invalidates it when
+    the held notes change; otherwise it stays cached.
+    """
+    __slots__ = ('__keyboard', '__order', '__velocities')
+
+    VOLATILE = False
+
+    def __init__(self, context, keyboard, order, velocities):
+        Chain.__init__(self, context)
+        self.__keyboard = keyboard
+        self.__order = order
+        self.__velocities = velocities
+
+    def sources(self):
+        return [self.__keyboard]
+
+    def instance(self):
+        pitches = self.__keyboard.pitches(self.__order)
+        if self.__velocities:
+            return [self.__keyboard.velocity(p) for p in pitches]
+        else:
+            return pitches
 
 class MidiIntHolder(Pulse):
     """
@@ -91,6 +244,8 @@ class MidiIntHolder(Pulse):
     range-check it.)  When fired, it simple holds the value; our
     Outputter actually farms and outputs the values.
     """
+    __slots__ = ('__value',)
+
     def __init__(self, context, initialValue):
         Pulse.__init__(self, context)
         self.__value = initialValue
@@ -110,14 +265,26 @@ class MidiIntHolder(Pulse):
     def get(self):
         return self.__value
 
+    def getState(self):
+        return self.__value
+
+    def setState(self, state):
+        self.__value = state
+
 class OutputterPulse(Pulse):
     """
     The Outputter pulse is a wrapper around an Outputter.
     """
+    __slots__ = ('__outputter',)
+
     def __init__(self, context, outputter):
         Pulse.__init__(self, context)
         self.__outputter = outputter
 
+    def targets(self):
+        o = self.__outputter
+        return [o.pitch, o.velocity, o.duration]
+
     def doFire(self, _):
         """
         >>> from const import C
@@ -132,21 +299,29 @@ class CtrlOutput(Pulse):
     """
     Pulse to send out CC messages.
     """
+    __slots__ = ('__maxObject', '__cc_no')
+
     def __init__(self, maxObject, context, cc_no):
         Pulse.__init__(self, context)
         self.__maxObject = maxObject
         self.__cc_no = cc_no
 
+    def controller(self):
+        return self.__cc_no
+
     def doFire(self, i):
         self.__maxObject.outletHigh(1, [self.__cc_no, i])
 
-class Outputter:
+class Outputter(object):
     """
     Holder, and emitter, of bundled MIDI note messages. Wrapped around
     a collection of MidiIntHolders for an entire note. These can be
     picked up by our collection of pulses and chains, as can its
-    fire() pulse to trigger the actual output.
+    fire() pulse to trigger the actual output. The `maxObject` can be
+    any OutputBackend.
     """
+    __slots__ = ('__maxObject', 'pitch', 'velocity', 'duration', 'emit')
+
     def __init__(self, maxObject, context, pitch, velocity, duration):
         self.__maxObject = maxObject
         self.pitch = MidiIntHolder(context, pitch)
@@ -160,6 +335,106 @@ class Outputter:
         d = self.duration.get()
         self.__maxObject.outletHigh(0, [p, v, d])
 
+class OutputBackend(object):
+    """
+    What Outputters and CtrlOutputs send to, in place of the Max object:
+    `outletHigh(outlet, args)` for each event (outlet 0 for notes as
+    [pitch, velocity, duration], 1 for CCs as [cc, value]), `setTick(n)`
+    before a tick's events and `flush()` after them. The Max object
+    only needs outletHigh; backends for other destinations (OutputBatch,
+    core.osc.OscBackend, core.render.EventBuffer,
+    core.midifile.MidiFileWriter) subclass this.
+    """
+    __slots__ = ()
+
+    def outletHigh(self, outlet, args):
+        pass
+
+    def setTick(self, tick):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class OutputBatch(OutputBackend):
+    """
+    Stands in for the Max object given to Outputters and CtrlOutputs,
+    holding on to their messages until flush() is called at the end of
+    the clock tick:
+
+        batch = OutputBatch(maxObject, batchOutlet=2)
+        outputter = Outputter(batch, c, 0, 0, 100)
+        ...
+        def clock(i):
+            c.tick()
+            input.fire(i)
+            c.settle()
+            batch.flush()
+
+    With a `batchOutlet`, flush() sends the whole tick as a single list
+    message on that outlet: for each event in order, its outlet number,
+    its argument count, then its arguments. Without one, the messages
+    are passed on one by one, in order. Either way the buffer is reused
+    from tick to tick, so the receiver must not hold on to the list.
+    """
+    __slots__ = ('__maxObject', '__batchOutlet', '__buffer')
+
+    def __init__(self, maxObject, batchOutlet=None):
+        self.__maxObject = maxObject
+        self.__batchOutlet = batchOutlet
+        self.__buffer = []
+
+    def outletHigh(self, outlet, args):
+        buffer = self.__buffer
+        buffer.append(outlet)
+        buffer.append(len(args))
+        buffer.extend(args)
+
+    def setTick(self, tick):
+        """
+        For headless use, where the Max object is a render sink.
+        """
+        self.__maxObject.setTick(tick)
+
+    def flush(self):
+        """
+        >>> from const import C
+        >>> maxObject = C(outletHigh=Mock('outletHigh'))
+        >>> batch = OutputBatch(maxObject, batchOutlet=2)
+        >>> out = Outputter(batch, None, 60, 100, 250)
+        >>> cc = CtrlOutput(batch, None, 7)
+        >>> out.emit.fire(0)
+        >>> cc.fire(64)
+        >>> batch.flush()
+        Called outletHigh(2, [0, 3, 60, 100, 250, 1, 2, 7, 64])
+        >>> batch.flush()
+
+        >>> batch = OutputBatch(maxObject)
+        >>> out = Outputter(batch, None, 60, 100, 250)
+        >>> cc = CtrlOutput(batch, None, 7)
+        >>> cc.fire(64)
+        >>> out.emit.fire(0)
+        >>> batch.flush()
+        Called outletHigh(1, [7, 64])
+        Called outletHigh(0, [60, 100, 250])
+        """
+        buffer = self.__buffer
+        if not buffer: return
+
+        if self.__batchOutlet is not None:
+            self.__maxObject.outletHigh(self.__batchOutlet, buffer)
+        else:
+            i = 0
+            while i < len(buffer):
+                n = buffer[i + 1]
+                self.__maxObject.outletHigh(buffer[i], buffer[i + 2:i + 2 + n])
+                i += 2 + n
+
+        del buffer[:]
+
 if __name__ == "__main__":
     import doctest
     from minimock import Mock
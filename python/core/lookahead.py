@@ -0,0 +1,260 @@
+"""
+Lookahead scheduling: evaluate the graph some ticks ahead of the clock,
+on a background thread, so that the real-time clock callback only has
+to pass on events which are already computed.
+
+The Lookahead stands in for the Max object when the graph's Outputters
+are built, capturing their output per tick:
+
+    la = Lookahead(maxObject, depth=8)
+    outputter = Outputter(la, c, 0, 0, 100)
+    ...
+    la.attach(c, input)
+    la.start()
+
+    def clock(i):
+        la.clock(i)
+
+The clock count is predicted to go up by one each tick (modulo `wrap`,
+if given); a tick which doesn't match the prediction is evaluated on
+the spot. Ticks already evaluated are thrown away, and the graph rolled
+back, as soon as an Atom, KeyboardChain or other mutable chain which
+the graph reads is changed (see Chain.edits()). Input posted to the
+context (see Context.post()) is held back from the ticks evaluated
+ahead: the next call to clock() rolls back, applies it and evaluates
+its tick afresh.
+"""
+
+import threading
+from collections import deque
+
+from core.basis import Chain, Pulse
+from core.graph import reachable, finalize
+
+class Lookahead:
+    def __init__(self, maxObject, depth=8, wrap=None):
+        self.__maxObject = maxObject
+        self.__depth = depth
+        self.__wrap = wrap
+        self.__lock = threading.Lock()
+        self.__wakeup = threading.Condition(self.__lock)
+        self.__queue = deque()
+        self.__events = None
+        self.__thread = None
+        self.__running = False
+        self.__evaluated = 0
+        self.__discarded = 0
+
+    def attach(self, context, pulse):
+        """
+        Set the context and root pulse to evaluate, and find the pulses
+        whose state must be rolled back, and the mutable chains whose
+        changes invalidate the lookahead. A cyclic graph is rejected
+        here (see `core.graph.finalize`), not on the background thread.
+        """
+        finalize(pulse)
+        context.hold(True)
+        self.__context = context
+        self.__pulse = pulse
+        nodes = reachable(pulse)
+        self.__pulses = [n for n in nodes if isinstance(n, Pulse)]
+        self.__watched = [n for n in nodes
+                          if isinstance(n, Chain) and n.MUTABLE and not n.VOLATILE]
+        self.__next = 0
+
+    def outletHigh(self, outlet, args):
+        self.__events.append((outlet, list(args)))
+
+    def __edits(self):
+        return sum([c.edits() for c in self.__watched])
+
+    def __snapshot(self):
+        return (self.__context.getState(), [p.getState() for p in self.__pulses])
+
+    def __restore(self, snapshot):
+        (contextState, pulseStates) = snapshot
+        self.__context.setState(contextState)
+        for (p, s) in zip(self.__pulses, pulseStates):
+            p.setState(s)
+
+    def __evaluate(self, i):
+        snapshot = self.__snapshot()
+        edits = self.__edits()
+        self.__events = []
+        self.__context.tick()
+        self.__pulse.fire(i)
+        self.__context.settle()
+        self.__queue.append((i, self.__events, snapshot, edits))
+        self.__events = None
+        self.__evaluated += 1
+        self.__next = i + 1
+        if self.__wrap is not None: self.__next %= self.__wrap
+
+    def __rollback(self, keep):
+        """
+        Discard all but the first `keep` queued ticks, rolling the graph
+        back to the state before the first one discarded.
+        """
+        if len(self.__queue) > keep:
+            (i, _, snapshot, _) = self.__queue[keep]
+            self.__restore(snapshot)
+            self.__next = i
+            while len(self.__queue) > keep:
+                self.__queue.pop()
+                self.__discarded += 1
+
+    def __validate(self):
+        edits = self.__edits()
+        for (n, entry) in enumerate(self.__queue):
+            if entry[3] != edits:
+                self.__rollback(n)
+                break
+
+    def fill(self):
+        """
+        Evaluate (in this thread) until the lookahead is full.
+        """
+        self.__lock.acquire()
+        try:
+            self.__validate()
+            while len(self.__queue) < self.__depth:
+                self.__evaluate(self.__next)
+        finally:
+            self.__lock.release()
+
+    def clock(self, i):
+        """
+        The real-time entry point: emit the events for clock count `i`,
+        evaluating them now if they aren't already queued.
+
+        >>> from core.basis import Context
+        >>> from core.interfacing import Outputter
+        >>> from core.render import EventBuffer, render
+        >>> from lib.chains import Atom, Transposer, Ranger, Assembler
+        >>> from lib.pulses import Cycler, Sprayer
+        >>> def build(c, sink, atom):
+        ...     out = Outputter(sink, c, 0, 100, 50)
+        ...     notes = Transposer(c, Assembler(c, Ranger(c, [3, 12]), 7), atom)
+        ...     fan = Sprayer(c, Cycler(c, notes, out.pitch, firstIf=1, nextIf='..', loopIf='..'), out.emit)
+        ...     return Cycler(c, '1101', fan, firstIf=0, nextIf='..', loopIf='..')
+
+        >>> c = Context(seed=5)
+        >>> plain = EventBuffer()
+        >>> render(c, build(c, plain, 60), plain, 40, wrap=16)
+
+        >>> c = Context(seed=5)
+        >>> received = EventBuffer()
+        >>> la = Lookahead(received, depth=6, wrap=16)
+        >>> atom = Atom(c, default=60)
+        >>> la.attach(c, build(c, la, atom))
+        >>> la.start()
+        >>> for i in range(40):
+        ...     received.setTick(i)
+        ...     la.clock(i % 16)
+        >>> la.stop()
+        >>> list(received.events()) == list(plain.events())
+        True
+
+        Changing an input throws away the lookahead:
+
+        >>> la.fill()
+        >>> atom.set(72)
+        >>> received.clear()
+        >>> la.clock(40 % 16)
+        >>> [p >= 72 for p in received.pitches]
+        [True]
+        >>> la.discarded()
+        6
+
+        So does a clock count other than the one expected:
+
+        >>> la.fill()
+        >>> received.clear()
+        >>> la.clock(0)
+        >>> len(received), la.discarded()
+        (1, 12)
+
+        Posted input is applied from the next clock count on:
+
+        >>> la.fill()
+        >>> c.post(atom.set, 84)
+        >>> received.clear()
+        >>> la.clock(1)
+        >>> [p >= 84 for p in received.pitches], la.discarded()
+        ([True], 18)
+        """
+        self.__lock.acquire()
+        try:
+            self.__validate()
+            if self.__context.pending():
+                self.__rollback(0)
+                self.__context.drain()
+            elif self.__queue and self.__queue[0][0] != i:
+                self.__rollback(0)
+            if not self.__queue:
+                self.__next = i
+                self.__evaluate(i)
+            (_, events, _, _) = self.__queue.popleft()
+            self.__wakeup.notify()
+        finally:
+            self.__lock.release()
+
+        for (outlet, args) in events:
+            self.__maxObject.outletHigh(outlet, args)
+
+    def __run(self):
+        # Take the lock one tick at a time, so that the clock is never
+        # kept waiting for longer than one evaluation:
+        while True:
+            self.__lock.acquire()
+            try:
+                if not self.__running: return
+                self.__validate()
+                if len(self.__queue) < self.__depth and not self.__context.pending():
+                    self.__evaluate(self.__next)
+                else:
+                    self.__wakeup.wait(0.05)
+            finally:
+                self.__lock.release()
+
+    def start(self):
+        """
+        Start evaluating in the background.
+        """
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__lock.acquire()
+        try:
+            self.__running = False
+            self.__wakeup.notify()
+        finally:
+            self.__lock.release()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def evaluated(self):
+        """
+        The number of ticks evaluated so far (including any discarded).
+        """
+        return self.__evaluated
+
+    def discarded(self):
+        """
+        The number of evaluated ticks thrown away, by changes of input
+        or by unexpected clock counts.
+        """
+        return self.__discarded
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
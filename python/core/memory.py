@@ -0,0 +1,65 @@
+"""
+Memory reporting for graphs of chains and pulses.
+"""
+
+import gc
+import sys
+
+from core.basis import Chain
+from core.graph import reachable
+
+def sizeOf(node):
+    """
+    Bytes held by a node itself: the object, its instance dictionary
+    if one has been allocated, and (for a chain) its cached instance.
+    >>> from core.basis import Const
+    >>> sizeOf(Const(None, [1, 2])) > 0
+    True
+    """
+    size = sys.getsizeof(node)
+    for r in gc.get_referents(node):
+        if type(r) is dict: size += sys.getsizeof(r)
+    if isinstance(node, Chain):
+        size += sys.getsizeof(node._Chain__instance)
+    return size
+
+def memoryReport(*roots):
+    """
+    Per-class node counts and sizes (in bytes) for everything reachable
+    from the roots, largest first, as (class name, count, bytes) tuples.
+    >>> from core.basis import Context
+    >>> from lib.chains import Assembler
+    >>> c = Context()
+    >>> [(name, n) for (name, n, _) in memoryReport(Assembler(c, 1, 2, [3]))]
+    [('Const', 3), ('Assembler', 1)]
+    """
+    totals = {}
+    for node in reachable(*roots):
+        name = node.__class__.__name__
+        (count, size) = totals.get(name, (0, 0))
+        totals[name] = (count + 1, size + sizeOf(node))
+    report = [(name, count, size) for (name, (count, size)) in totals.items()]
+    report.sort(key=lambda r: (-r[2], r[0]))
+    return report
+
+def formatMemoryReport(report):
+    """
+    >>> print formatMemoryReport([('Const', 3, 300), ('Assembler', 1, 120)])
+    Const                3      300
+    Assembler            1      120
+    total                4      420
+    """
+    lines = ["%-16s %5d %8d" % r for r in report]
+    lines.append("%-16s %5d %8d" % ('total',
+                                    sum([n for (_, n, _) in report]),
+                                    sum([b for (_, _, b) in report])))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,180 @@
+"""
+Standard MIDI File export of headless renders.
+
+A MidiFileWriter is a render sink (see core.render): it stands in for the
+Max object given to Outputters and CtrlOutputs, and streams their notes
+and CCs to a format 0 file as they arrive. Only the note-offs still to
+come are held in memory, so a render of any length runs in bounded space.
+"""
+
+import heapq
+import struct
+
+from core.basis import Context
+from core.interfacing import OutputBackend
+from core.render import render
+
+def varLen(n):
+    """
+    MIDI variable-length quantity.
+    >>> [varLen(n) for n in [0, 0x40, 0x7F, 0x80, 0x2000, 0x3FFF, 0x4000]] == \\
+    ...     ['\\x00', '\\x40', '\\x7f', '\\x81\\x00', '\\xc0\\x00', '\\xff\\x7f', '\\x81\\x80\\x00']
+    True
+    """
+    result = chr(n & 0x7F)
+    n >>= 7
+    while n:
+        result = chr(0x80 | (n & 0x7F)) + result
+        n >>= 7
+    return result
+
+def byte7(n):
+    return max(0, min(127, n))
+
+class MidiFileWriter(OutputBackend):
+    """
+    Write a format 0 file to `f` (a file name, or a seekable file open for
+    binary writing). Clock ticks are `ticksPerBeat` to the beat (8, for
+    the 32nd-note clock from the divider) at `bpm`; note durations are
+    taken to be in milliseconds, as for makenote.
+    """
+    def __init__(self, f, bpm=120, ticksPerBeat=8, division=480, channel=0):
+        if isinstance(f, str):
+            self.__file = open(f, 'wb')
+            self.__ownFile = True
+        else:
+            self.__file = f
+            self.__ownFile = False
+
+        self.__bpm = bpm
+        self.__ticksPerBeat = ticksPerBeat
+        self.__division = division
+        self.__channel = channel & 0x0F
+        self.__now = 0
+        self.__lastWritten = 0
+        self.__trackBytes = 0
+        self.__pendingOffs = []
+        self.__sequence = 0
+
+        self.__file.write('MThd' + struct.pack('>LHHH', 6, 0, 1, division))
+        self.__file.write('MTrk')
+        self.__lengthAt = self.__file.tell()
+        self.__file.write(struct.pack('>L', 0))
+        microsPerBeat = int(round(60000000.0 / bpm))
+        self.__event(0, '\xff\x51\x03' + struct.pack('>L', microsPerBeat)[1:])
+
+    def __event(self, time, data):
+        chunk = varLen(time - self.__lastWritten) + data
+        self.__lastWritten = time
+        self.__trackBytes += len(chunk)
+        self.__file.write(chunk)
+
+    def __releaseUntil(self, time):
+        offs = self.__pendingOffs
+        while offs and offs[0][0] <= time:
+            (t, _, pitch) = heapq.heappop(offs)
+            self.__event(t, chr(0x80 | self.__channel) + chr(pitch) + '\x00')
+
+    def setTick(self, tick):
+        self.__now = tick * self.__division // self.__ticksPerBeat
+        self.__releaseUntil(self.__now)
+
+    def flush(self):
+        pass
+
+    def outletHigh(self, outlet, args):
+        if outlet == 0:
+            (pitch, velocity, duration) = [byte7(args[0]), byte7(args[1]), args[2]]
+            if velocity == 0: return
+            length = int(round(duration * self.__bpm * self.__division / 60000.0))
+            self.__event(self.__now, chr(0x90 | self.__channel) + chr(pitch) + chr(velocity))
+            self.__sequence += 1
+            heapq.heappush(self.__pendingOffs,
+                           (self.__now + max(length, 1), self.__sequence, pitch))
+        elif outlet == 1:
+            self.__event(self.__now, chr(0xB0 | self.__channel)
+                                     + chr(byte7(args[0])) + chr(byte7(args[1])))
+
+    def close(self):
+        """
+        Release any notes still sounding, end the track, and fill in
+        its length.
+        """
+        self.__releaseUntil(self.__now + (1 << 27))
+        self.__event(self.__lastWritten, '\xff\x2f\x00')
+        end = self.__file.tell()
+        self.__file.seek(self.__lengthAt)
+        self.__file.write(struct.pack('>L', self.__trackBytes))
+        self.__file.seek(end)
+        if self.__ownFile: self.__file.close()
+
+def readMidi(data):
+    """
+    Read back a file as written here (format 0, no running status):
+    returns the division and a list of (absolute time, event bytes).
+    """
+    (_, _, _, division) = struct.unpack('>LHHH', data[4:14])
+    (length,) = struct.unpack('>L', data[18:22])
+    pos = 22
+    end = pos + length
+    time = 0
+    events = []
+    while pos < end:
+        delta = 0
+        while True:
+            b = ord(data[pos])
+            pos += 1
+            delta = (delta << 7) | (b & 0x7F)
+            if b < 0x80: break
+        time += delta
+        if data[pos] == '\xff':
+            n = ord(data[pos + 2])
+            size = 3 + n
+        else:
+            size = 3
+        events.append((time, data[pos:pos + size]))
+        pos += size
+    return (division, events)
+
+def exportMidi(f, factory, ticks, seed=None, wrap=None, params=None, **options):
+    """
+    Build a graph from a factory (see core.batch), render it for `ticks`
+    ticks straight to a MIDI file, and close the file.
+
+    >>> from cStringIO import StringIO
+    >>> from lib.pulses import Cycler, Sprayer
+    >>> from core.interfacing import Outputter, CtrlOutput
+    >>> def factory(c, sink):
+    ...     out = Outputter(sink, c, 0, 100, 250)
+    ...     fan = Sprayer(c, out.pitch, out.emit, CtrlOutput(sink, c, 7))
+    ...     return Cycler(c, [60, 64], fan, firstIf=0, nextIf='..', loopIf='..')
+    >>> f = StringIO()
+    >>> exportMidi(f, factory, 3)
+    >>> (division, events) = readMidi(f.getvalue())
+    >>> division
+    480
+    >>> [(t, [ord(b) for b in e]) for (t, e) in events]
+    [(0, [255, 81, 3, 7, 161, 32]),
+     (0, [144, 60, 100]), (0, [176, 7, 60]),
+     (60, [144, 64, 100]), (60, [176, 7, 64]),
+     (120, [144, 60, 100]), (120, [176, 7, 60]),
+     (240, [128, 60, 0]),
+     (300, [128, 64, 0]),
+     (360, [128, 60, 0]),
+     (360, [255, 47, 0])]
+    """
+    if params is None: params = {}
+    writer = MidiFileWriter(f, **options)
+    context = Context(seed=seed)
+    root = factory(context, writer, **params)
+    render(context, root, writer, ticks, wrap=wrap)
+    writer.close()
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,149 @@
+"""
+OSC over UDP output: an OutputBackend which sends each tick's events
+as a single OSC bundle, for driving synths or other hosts when running
+headless.
+
+    osc = OscBackend('127.0.0.1', 57120)
+    outputter = Outputter(osc, c, 0, 0, 100)
+    ...
+    render(c, input, osc, ticks)        # or a core.clock.Player
+
+Notes go to /pulse/note (pitch, velocity, duration) and CCs to /pulse/cc
+(cc, value), as int32s, unless other addresses are given per outlet.
+"""
+
+import socket
+import struct
+
+from core.interfacing import OutputBackend
+
+BUNDLE_HEADER = '#bundle\0' + struct.pack('>Q', 1)    # Time tag: "immediately".
+
+# Keep well under the IPv4 UDP payload limit:
+MAX_DATAGRAM = 32768
+
+def oscString(s):
+    """
+    >>> oscString('/a'), oscString('/abc'), oscString(',ii')
+    ('/a\\x00\\x00', '/abc\\x00\\x00\\x00\\x00', ',ii\\x00')
+    """
+    return s + '\0' * (4 - len(s) % 4)
+
+def readString(data, pos):
+    end = data.index('\0', pos)
+    return (data[pos:end], (end // 4 + 1) * 4)
+
+def parseBundle(data):
+    """
+    Decode a bundle of int32 messages, as sent by OscBackend, to a list
+    of (address, args).
+    """
+    if not data.startswith(BUNDLE_HEADER[:8]):
+        raise ValueError("not an OSC bundle")
+    pos = 16
+    messages = []
+    while pos < len(data):
+        (size,) = struct.unpack('>i', data[pos:pos + 4])
+        message = data[pos + 4:pos + 4 + size]
+        (address, p) = readString(message, 0)
+        (tags, p) = readString(message, p)
+        n = len(tags) - 1
+        messages.append((address, list(struct.unpack('>%di' % n, message[p:p + 4 * n]))))
+        pos += 4 + size
+    return messages
+
+class OscBackend(OutputBackend):
+    """
+    >>> from core.basis import Context
+    >>> from core.interfacing import Outputter, CtrlOutput
+    >>> from core.render import render
+    >>> from lib.pulses import Cycler, Sprayer
+    >>> listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    >>> listener.bind(('127.0.0.1', 0))
+    >>> listener.settimeout(5)
+    >>> osc = OscBackend(*listener.getsockname())
+
+    >>> c = Context()
+    >>> out = Outputter(osc, c, 0, 100, 250)
+    >>> fan = Sprayer(c, out.pitch, out.emit, CtrlOutput(osc, c, 7))
+    >>> root = Cycler(c, '3.5', fan, firstIf=0, nextIf='..', loopIf='..')
+    >>> render(c, root, osc, 3)
+    >>> for tick in range(2):
+    ...     print parseBundle(listener.recv(65536))
+    [('/pulse/note', [3, 100, 250]), ('/pulse/cc', [7, 3])]
+    [('/pulse/note', [5, 100, 250]), ('/pulse/cc', [7, 5])]
+    >>> osc.sent()
+    2
+
+    A tick too big for one datagram goes in several bundles:
+
+    >>> for i in range(3000): osc.outletHigh(1, [i % 128, 64])
+    >>> osc.flush()
+    >>> sizes = []
+    >>> while sum(sizes) < 3000:
+    ...     sizes.append(len(parseBundle(listener.recv(65536))))
+    >>> len(sizes) > 1, sum(sizes), osc.sent() == 2 + len(sizes)
+    (True, 3000, True)
+
+    >>> osc.close()
+    >>> listener.close()
+    """
+    def __init__(self, host='127.0.0.1', port=57120, addresses=None, sock=None):
+        self.__target = (host, port)
+        self.__addresses = {0: '/pulse/note', 1: '/pulse/cc'}
+        if addresses: self.__addresses.update(addresses)
+        if sock is None:
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.__ownSocket = True
+        else:
+            self.__socket = sock
+            self.__ownSocket = False
+        # (outlet, argument count) -> (packer, size, encoded address and type tags):
+        self.__formats = {}
+        # Events are packed straight into one datagram-sized buffer:
+        self.__buffer = bytearray(MAX_DATAGRAM)
+        self.__buffer[:len(BUNDLE_HEADER)] = BUNDLE_HEADER
+        self.__size = len(BUNDLE_HEADER)
+        self.__sent = 0
+
+    def __format(self, outlet, n):
+        address = self.__addresses.get(outlet, '/pulse/%d' % outlet)
+        prefix = oscString(address) + oscString(',' + 'i' * n)
+        packer = struct.Struct('>i%ds%di' % (len(prefix), n))
+        entry = (packer, packer.size - 4, prefix)
+        self.__formats[(outlet, n)] = entry
+        return entry
+
+    def outletHigh(self, outlet, args):
+        try:
+            (packer, size, prefix) = self.__formats[(outlet, len(args))]
+        except KeyError:
+            (packer, size, prefix) = self.__format(outlet, len(args))
+        if self.__size + size + 4 > MAX_DATAGRAM: self.flush()
+        packer.pack_into(self.__buffer, self.__size, size, prefix, *args)
+        self.__size += size + 4
+
+    def flush(self):
+        if self.__size > len(BUNDLE_HEADER):
+            self.__socket.sendto(buffer(self.__buffer, 0, self.__size), self.__target)
+            self.__sent += 1
+            self.__size = len(BUNDLE_HEADER)
+
+    def sent(self):
+        """
+        The number of datagrams sent.
+        """
+        return self.__sent
+
+    def close(self):
+        self.flush()
+        if self.__ownSocket: self.__socket.close()
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,258 @@
+"""
+Per-node profiling of a graph: for every chain, calls to `instance()`
+(and cache hits against misses in the lookup which guards it), and for
+every pulse, calls to `doFire()`; each with calls per tick, total and
+maximum time, and self time (excluding the nodes it called).
+
+Profiling works by wrapping those methods on the node objects
+themselves, so an unprofiled graph runs exactly the code it always
+did. Nodes are named from a dictionary of names, such as the module
+namespace in main.py:
+
+    profiler = Profiler()
+    profiler.attach(c, input, names=globals())
+    ...
+    print profiler.formatReport()
+    profiler.detach()
+"""
+
+import json
+from timeit import default_timer
+
+from core.basis import Chain, Pulse
+from core.graph import reachable
+
+class NodeStats:
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.calls = 0
+        self.total = 0.0
+        self.selfTime = 0.0
+        self.max = 0.0
+        self.lookups = 0
+        self.lazy = 0
+        self.tickCalls = 0
+        self.maxTickCalls = 0
+        self.lastTick = None
+
+class Profiler:
+    def __init__(self, timer=default_timer):
+        self.__timer = timer
+        self.__stats = []
+        self.__patched = []
+        self.__stack = []
+        self.__ticks = 0
+        self.__context = None
+
+    def __patch(self, obj, attr, replacement):
+        previous = obj.__dict__.get(attr)
+        self.__patched.append((obj, attr, previous))
+        setattr(obj, attr, replacement)
+
+    def __timed(self, node, attr, stats):
+        original = getattr(node, attr)
+        timer = self.__timer
+        stack = self.__stack
+        profiler = self
+
+        def timed(*args):
+            tick = profiler.__ticks
+            if stats.lastTick != tick:
+                stats.lastTick = tick
+                stats.tickCalls = 0
+            stats.tickCalls += 1
+            if stats.tickCalls > stats.maxTickCalls:
+                stats.maxTickCalls = stats.tickCalls
+
+            stack.append(0.0)
+            t0 = timer()
+            try:
+                return original(*args)
+            finally:
+                elapsed = timer() - t0
+                inner = stack.pop()
+                if stack: stack[-1] += elapsed
+                stats.calls += 1
+                stats.total += elapsed
+                stats.selfTime += elapsed - inner
+                if elapsed > stats.max: stats.max = elapsed
+
+        self.__patch(node, attr, timed)
+
+    def __counted(self, node, stats):
+        original = node._Chain__setupInstance
+
+        def lookup():
+            stats.lookups += 1
+            original()
+
+        self.__patch(node, '_Chain__setupInstance', lookup)
+
+        if node.LAZY:
+            for attr in ['lazyLength', 'lazyItem']:
+                self.__patch(node, attr, self.__countedLazy(getattr(node, attr), stats))
+
+    def __countedLazy(self, original, stats):
+        def lazy(*args):
+            stats.lazy += 1
+            return original(*args)
+        return lazy
+
+    def attach(self, context, *roots, **kw):
+        """
+        Start profiling every node reachable from the roots. `names`
+        (keyword) maps names to nodes; other entries are ignored, and
+        unnamed nodes are called after their class.
+        """
+        names = kw.get('names') or {}
+        self.detach()
+        self.__context = context
+        self.__ticks = 0
+        self.__stats = []
+
+        byId = {}
+        for (name, node) in sorted(names.items()):
+            if isinstance(node, (Chain, Pulse)):
+                byId.setdefault(id(node), name)
+                # A named chain may have been folded into a Const:
+                if isinstance(node, Chain) and node in context.folded():
+                    byId.setdefault(id(context.fold(node)), name)
+
+        counts = {}
+        for node in reachable(*roots):
+            name = byId.get(id(node))
+            if name is None:
+                cls = node.__class__.__name__
+                counts[cls] = counts.get(cls, 0) + 1
+                name = "%s#%d" % (cls, counts[cls])
+            if isinstance(node, Chain):
+                stats = NodeStats(name, 'chain')
+                self.__timed(node, 'instance', stats)
+                self.__counted(node, stats)
+            else:
+                stats = NodeStats(name, 'pulse')
+                self.__timed(node, 'doFire', stats)
+            self.__stats.append(stats)
+
+        original = context.tick
+        profiler = self
+
+        def tick():
+            profiler.__ticks += 1
+            original()
+
+        self.__patch(context, 'tick', tick)
+
+    def detach(self):
+        """
+        Stop profiling, restoring the nodes as they were. The results
+        gathered so far are kept.
+        """
+        for (obj, attr, previous) in reversed(self.__patched):
+            if previous is None:
+                delattr(obj, attr)
+            else:
+                setattr(obj, attr, previous)
+        self.__patched = []
+
+    def ticks(self):
+        return self.__ticks
+
+    def report(self):
+        """
+        One dictionary per node, most total time first. For chains,
+        `misses` are the calls to `instance()`, `hits` the lookups
+        satisfied from the cache, and `lazy` the lengths and elements
+        computed without building the instance (see Chain.LAZY).
+
+        >>> from core.basis import Context
+        >>> from core.interfacing import Outputter
+        >>> from lib.chains import Transposer, Ranger
+        >>> from lib.pulses import Cycler, Sprayer
+        >>> c = Context(fold=False)
+        >>> from core.render import EventBuffer
+        >>> out = Outputter(EventBuffer(), c, 0, 100, 50)
+        >>> notes = Transposer(c, Ranger(c, [4, 12]), 60)
+        >>> fan = Sprayer(c, Cycler(c, notes, out.pitch, firstIf=1, nextIf='..', loopIf='..'), out.emit)
+        >>> input = Cycler(c, '1.', fan, firstIf=0, nextIf='..', loopIf='..')
+
+        >>> p = Profiler()
+        >>> p.attach(c, input, names={'notes': notes, 'fan': fan, 'c': c})
+        >>> for i in range(10):
+        ...     c.tick()
+        ...     input.fire(i)
+        >>> rows = dict([(r['name'], r) for r in p.report()])
+        >>> rows['fan']['calls'], rows['fan']['per_tick']
+        (5, 0.5)
+        >>> (rows['notes']['misses'], rows['notes']['hits'], rows['notes']['lazy'])
+        (5, 5, 0)
+        >>> rows['Ranger#1']['kind'], rows['Cycler#2']['max_per_tick']
+        ('chain', 1)
+        >>> rows['fan']['total'] >= rows['fan']['self']
+        True
+
+        Detaching leaves the graph as it was:
+
+        >>> p.detach()
+        >>> 'instance' in notes.__dict__, 'doFire' in fan.__dict__, 'tick' in c.__dict__
+        (False, False, False)
+        """
+        ticks = max(self.__ticks, 1)
+        rows = []
+        for s in self.__stats:
+            row = {'name': s.name,
+                   'kind': s.kind,
+                   'calls': s.calls,
+                   'per_tick': float(s.calls) / ticks,
+                   'max_per_tick': s.maxTickCalls,
+                   'total': s.total,
+                   'self': s.selfTime,
+                   'max': s.max}
+            if s.kind == 'chain':
+                row['misses'] = s.calls
+                row['hits'] = s.lookups - s.calls
+                row['lazy'] = s.lazy
+            rows.append(row)
+        rows.sort(key=lambda r: (-r['total'], r['name']))
+        return rows
+
+    def formatReport(self, limit=None):
+        """
+        The report as a table, times in microseconds.
+        """
+        lines = ["%-24s %7s %9s %10s %10s %8s %8s" %
+                 ('node', 'calls', 'per tick', 'total', 'self', 'max', 'hit %')]
+        for r in self.report()[:limit]:
+            if r['kind'] == 'chain' and r['hits'] + r['misses'] > 0:
+                hits = "%8.1f" % (100.0 * r['hits'] / (r['hits'] + r['misses']))
+            else:
+                hits = "%8s" % '-'
+            lines.append("%-24s %7d %9.2f %10.0f %10.0f %8.0f %s" %
+                         (r['name'][:24], r['calls'], r['per_tick'],
+                          r['total'] * 1e6, r['self'] * 1e6, r['max'] * 1e6, hits))
+        return "\n".join(lines)
+
+    def dump(self, f):
+        """
+        Write the tick count and report to a file (name or open file)
+        as JSON.
+        """
+        data = {'ticks': self.__ticks, 'nodes': self.report()}
+        if isinstance(f, str):
+            out = open(f, 'w')
+            try:
+                json.dump(data, out, indent=2, sort_keys=True)
+            finally:
+                out.close()
+        else:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,107 @@
+"""
+Headless rendering: drive a context and its root pulse without a Max
+host, capturing output events into a compact columnar buffer.
+
+A sink is anything which can stand in for the Max object handed to an
+Outputter or CtrlOutput: it has `outletHigh(outlet, args)`, plus
+`setTick(n)` (called before each tick) and `flush()` (called after it),
+as in core.interfacing.OutputBackend.
+"""
+
+from array import array
+
+from core.interfacing import OutputBackend
+
+class EventBuffer(OutputBackend):
+    """
+    A sink which records every event in parallel integer columns: tick,
+    outlet, pitch, velocity and duration. CC events (outlet 1) carry
+    the controller number in the pitch column, the value in the
+    velocity column, and a duration of 0.
+    """
+    def __init__(self):
+        self.__tick = 0
+        self.clear()
+
+    def clear(self):
+        self.ticks = array('l')
+        self.outlets = array('l')
+        self.pitches = array('l')
+        self.velocities = array('l')
+        self.durations = array('l')
+
+    def setTick(self, tick):
+        self.__tick = tick
+
+    def flush(self):
+        pass
+
+    def outletHigh(self, outlet, args):
+        """
+        >>> b = EventBuffer()
+        >>> b.setTick(7)
+        >>> b.outletHigh(0, [60, 100, 250])
+        >>> b.outletHigh(1, [74, 12])
+        >>> len(b)
+        2
+        >>> list(b.events())
+        [(7, 0, 60, 100, 250), (7, 1, 74, 12, 0)]
+        """
+        self.ticks.append(self.__tick)
+        self.outlets.append(outlet)
+        self.pitches.append(args[0])
+        self.velocities.append(args[1])
+        if len(args) > 2:
+            self.durations.append(args[2])
+        else:
+            self.durations.append(0)
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def events(self):
+        """
+        Iterate over the recorded events as
+        (tick, outlet, pitch, velocity, duration) tuples.
+        """
+        for i in xrange(len(self.ticks)):
+            yield (self.ticks[i], self.outlets[i], self.pitches[i],
+                   self.velocities[i], self.durations[i])
+
+def render(context, pulse, sink, ticks, start=0, wrap=None):
+    """
+    Run `ticks` clock ticks from `start`, as Max would via `clock(i)`:
+    tick the context and fire the root pulse with the clock count (taken
+    modulo `wrap`, if given, like the Max-side divider). The sink should
+    be the object the graph's Outputters were built with.
+
+    >>> from core.basis import Context
+    >>> from core.interfacing import Outputter
+    >>> from lib.pulses import Cycler, Sprayer
+    >>> c = Context()
+    >>> buf = EventBuffer()
+    >>> out = Outputter(buf, c, 0, 100, 50)
+    >>> fan = Sprayer(c, out.pitch, out.emit)
+    >>> root = Cycler(c, '345', fan, firstIf=0, nextIf='..', loopIf='..')
+    >>> render(c, root, buf, 5, wrap=4)
+    >>> list(buf.events())
+    [(0, 0, 3, 100, 50), (1, 0, 4, 100, 50), (2, 0, 5, 100, 50), (3, 0, 3, 100, 50), (4, 0, 3, 100, 50)]
+    """
+    for n in xrange(start, start + ticks):
+        sink.setTick(n)
+        context.tick()
+        if wrap is None:
+            pulse.fire(n)
+        else:
+            pulse.fire(n % wrap)
+        context.settle()
+        sink.flush()
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -1,6 +1,43 @@
 from manifest import *
 import string
 
+DIGITS = {}
+for ch in string.digits: DIGITS[ch] = ord(ch) - ord('0')
+DIGITS['.'] = None
+
+# Interned literals: spell strings to their values, and value tuples to
+# a single shared copy of each. The tables are process-wide, so they're
+# bounded: one which reaches INTERN_LIMIT entries is emptied, which only
+# costs the sharing of what was in it.
+INTERN_LIMIT = 10000
+_spells = {}
+_literals = {}
+
+def _shared(t):
+    if len(_literals) >= INTERN_LIMIT: _literals.clear()
+    return _literals.setdefault(t, t)
+
+def spell(s):
+    """
+    The values of a string of digits and dots, as an interned tuple.
+
+    >>> spell('1.2')
+    (1, None, 2)
+    >>> spell('0.0..00.') is spell('0.0..00.')
+    True
+    """
+    try:
+        return _spells[s]
+    except KeyError:
+        try:
+            t = tuple([DIGITS[ch] for ch in s])
+        except KeyError:
+            raise SyntaxError(s)
+        t = _shared(t)
+        if len(_spells) >= INTERN_LIMIT: _spells.clear()
+        _spells[s] = t
+        return t
+
 def flatten(item):
     """
     Turn the item (a string, an int, or recursively a list of items)
@@ -21,6 +58,11 @@ def flatten(item):
     >>> flatten([1, [2, [3, [4, 5], 6], 7], 8])
     [1, 2, 3, 4, 5, 6, 7, 8]
 
+    >>> deep = [9]
+    >>> for i in range(5000): deep = [i % 10, deep]
+    >>> len(flatten(deep))
+    5001
+
     >>> flatten(5)
     [5]
 
@@ -30,23 +72,45 @@ def flatten(item):
     SyntaxError: $@%^&$@
     """
     if type(item) == STRING_type:
+        return list(spell(item))
+    elif type(item) == LIST_type:
+        # Iteratively, with a stack of iterators, so that deep nesting
+        # neither recurses nor copies partial results:
         result = []
-        for ch in item:
-            if ch in string.digits:
-                result.append(ord(ch) - ord('0'))
-            elif ch == '.':
-                result.append(None)
+        stack = [iter(item)]
+        while stack:
+            for i in stack[-1]:
+                t = type(i)
+                if t == LIST_type:
+                    stack.append(iter(i))
+                    break
+                elif t == STRING_type:
+                    result.extend(spell(i))
+                else:
+                    result.append(i)
             else:
-                raise SyntaxError(item)
-
+                stack.pop()
         return result
-    elif type(item) == LIST_type:
-        x = []
-        for i in item: x += flatten(i)
-        return x
     else:
         return [item]
 
+def literal(item):
+    """
+    Flatten an item into a tuple, shared with every other literal
+    having the same values.
+
+    >>> literal([1, '2.']) is literal(['12', None])
+    True
+    >>> literal(5)
+    (5,)
+    >>> for i in range(INTERN_LIMIT + 10): t = literal([i, 0])
+    >>> len(_literals) <= INTERN_LIMIT
+    True
+    """
+    if type(item) == STRING_type:
+        return spell(item)
+    return _shared(tuple(flatten(item)))
+
 if __name__ == "__main__":
     import doctest
     from minimock import Mock
@@ -0,0 +1,460 @@
+'''
+Batched evaluation: run one graph for many random seeds at once. Every
+chain carries a leading lane axis (one lane per seed) and is evaluated
+with NumPy across all the lanes together: each Ranger draws a vector per
+lane, each Selector chooses per lane, each Cycler keeps a counter per
+lane, and the Outputters record an event stream per lane. Lane `b`
+produces exactly what rendering the graph with `Context(seed=seeds[b])`
+would.
+
+The graph is built once, as usual, and then translated: it must be made
+from lib.chains, lib.pulses and core.interfacing nodes (other chains
+can take part only if they don't change from tick to tick), and its
+pulses must have the EVERY policy.
+
+    run = renderLanes(factory, range(1000), 256)
+    run.events(17)      # as EventBuffer.events() for seed 17
+
+A chain's value over the lanes is a (data, mask, lengths) triple:
+int64 data and a boolean mask (False for empty slots and for padding),
+both B x L for the longest lane, and the B lane lengths.
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from core.basis import Pulse, Const, Context, MASK
+from core.interfacing import KeyboardChain, KeyboardView, MidiIntHolder, \
+    OutputterPulse, CtrlOutput
+from core.render import EventBuffer
+from lib.chains import Assembler, Atom, Transposer, Ranger, Indexer, Selector
+from lib.pulses import Sprayer, Cycler
+from lib.vectors import absorbArray as absorb
+
+def lanes(data, lengths):
+    """
+    A full (data, mask, lengths) triple from B x L data and the lengths.
+    """
+    mask = numpy.arange(data.shape[1])[None, :] < lengths[:, None]
+    return (numpy.where(mask, data, 0), mask, lengths)
+
+class BatchChain:
+    """
+    A chain translated for batched evaluation: subclasses provide
+    `compute()`. Values are cached for the tick, or for good if the
+    original chain is static.
+    """
+    def __init__(self, run, node):
+        self.run = run
+        self.static = node.isStatic()
+        self.__tick = None
+        self.__value = None
+
+    def value(self):
+        tick = self.run.tick
+        if self.__tick != tick and not (self.static and self.__value is not None):
+            self.__tick = tick
+            self.__value = self.compute()
+        return self.__value
+
+    def first(self):
+        """
+        Element 0 of each lane, and whether it's there (not empty or None).
+        """
+        (data, mask, lengths) = self.value()
+        if data.shape[1] == 0:
+            return (numpy.zeros(self.run.size, dtype=numpy.int64),
+                    numpy.zeros(self.run.size, dtype=bool))
+        return (data[:, 0], mask[:, 0])
+
+class Scalar(BatchChain):
+    """
+    A chain which is the same in every lane.
+    """
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        self.node = node
+
+    def compute(self):
+        values = self.node.values()
+        b = self.run.size
+        data = numpy.array([[0 if v is None else v for v in values]], dtype=numpy.int64)
+        mask = numpy.array([[v is not None for v in values]], dtype=bool)
+        return (numpy.repeat(data.reshape(1, len(values)), b, axis=0),
+                numpy.repeat(mask.reshape(1, len(values)), b, axis=0),
+                numpy.repeat(len(values), b))
+
+class BAssembler(BatchChain):
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        self.parts = [run.chain(c) for c in node.sources()]
+
+    def compute(self):
+        b = self.run.size
+        values = [p.value() for p in self.parts]
+        lengths = numpy.zeros(b, dtype=numpy.int64)
+        for (_, _, n) in values: lengths = lengths + n
+        width = int(lengths.max()) if b else 0
+        data = numpy.zeros((b, width), dtype=numpy.int64)
+        mask = numpy.zeros((b, width), dtype=bool)
+        offset = numpy.zeros(b, dtype=numpy.int64)
+        for (d, m, n) in values:
+            (rows, cols) = numpy.nonzero(numpy.arange(d.shape[1])[None, :] < n[:, None])
+            data[rows, offset[rows] + cols] = d[rows, cols]
+            mask[rows, offset[rows] + cols] = m[rows, cols]
+            offset += n
+        return (data, mask, lengths)
+
+class BTransposer(BatchChain):
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        (self.source, self.xpose) = [run.chain(c) for c in node.sources()]
+
+    def compute(self):
+        (data, mask, lengths) = self.source.value()
+        (v, present) = self.xpose.first()
+        shift = numpy.where(present, v, 0)[:, None]
+        return (numpy.where(mask, data + shift, 0), mask, lengths)
+
+class BRanger(BatchChain):
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        (self.params,) = [run.chain(c) for c in node.sources()]
+        self.key = node.key()
+
+    def compute(self):
+        b = self.run.size
+        (data, mask, lengths) = self.params.value()
+        none = numpy.zeros(b, dtype=bool)
+        if data.shape[1] == 0:
+            (p0, m0, p1, m1) = (numpy.zeros(b, dtype=numpy.int64), none, numpy.zeros(b, dtype=numpy.int64), none)
+        elif data.shape[1] == 1:
+            (p0, m0, p1, m1) = (data[:, 0], mask[:, 0], numpy.zeros(b, dtype=numpy.int64), none)
+        else:
+            (p0, m0, p1, m1) = (data[:, 0], mask[:, 0], data[:, 1], mask[:, 1])
+
+        single = lengths == 1
+        n = numpy.where(single, 1, numpy.where(lengths > 1, p0, 0))
+        nGiven = single | (m0 & (lengths > 1))
+        n = numpy.where(nGiven & (n > 0), n, 0)
+        lim = numpy.where(single, p0, p1)
+        limGiven = numpy.where(single, m0, m1) & (lim > 0)
+
+        width = int(n.max()) if b else 0
+        u = numpy.uint64
+        base = absorb(absorb(self.run.seeds, u(self.run.tick & MASK)), u(self.key))
+        x = absorb(base[:, None], numpy.arange(width, dtype=u)[None, :])
+        x = x % numpy.where(limGiven, lim, 1).astype(u)[:, None]
+        (data, mask, lengths) = lanes(x.astype(numpy.int64), n)
+        mask = mask & limGiven[:, None]
+        return (numpy.where(mask, data, 0), mask, lengths)
+
+class BIndexer(BatchChain):
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        (self.values, self.indices) = [run.chain(c) for c in node.sources()]
+
+    def compute(self):
+        (vd, vm, vn) = self.values.value()
+        (idx, im, n) = self.indices.value()
+        valid = im & (idx >= 0) & (idx < vn[:, None])
+        if vd.shape[1] == 0:
+            return (numpy.zeros(idx.shape, dtype=numpy.int64), numpy.zeros(idx.shape, dtype=bool), n)
+        safe = numpy.where(valid, idx, 0)
+        rows = numpy.arange(idx.shape[0])[:, None]
+        mask = valid & vm[rows, safe]
+        return (numpy.where(mask, vd[rows, safe], 0), mask, n)
+
+class BSelector(BatchChain):
+    def __init__(self, run, node):
+        BatchChain.__init__(self, run, node)
+        sources = [run.chain(c) for c in node.sources()]
+        self.index = sources[0]
+        self.choices = sources[1:]
+
+    def compute(self):
+        b = self.run.size
+        (idx, present) = self.index.first()
+        values = [c.value() for c in self.choices]
+        width = max([0] + [d.shape[1] for (d, _, _) in values])
+        data = numpy.zeros((b, width), dtype=numpy.int64)
+        mask = numpy.zeros((b, width), dtype=bool)
+        lengths = numpy.zeros(b, dtype=numpy.int64)
+        for (k, (d, m, n)) in enumerate(values):
+            chosen = present & (idx == k)
+            w = d.shape[1]
+            data[chosen, :w] = d[chosen]
+            mask[chosen, :w] = m[chosen]
+            lengths[chosen] = n[chosen]
+        return (data, mask, lengths)
+
+CHAINS = [(Assembler, BAssembler),
+          (Transposer, BTransposer),
+          (Ranger, BRanger),
+          (Indexer, BIndexer),
+          (Selector, BSelector)]
+
+# Chains which hold no random state, so are the same in every lane
+# even when they change:
+SCALARS = (Const, Atom, KeyboardChain, KeyboardView)
+
+def inRange(values, condition):
+    """
+    lib.pulses.rangePredicate over the lanes.
+    """
+    (data, mask, lengths) = condition.value()
+    if data.shape[1] == 0:
+        return numpy.zeros(len(values), dtype=bool)
+    (c0, m0) = (data[:, 0], mask[:, 0])
+    if data.shape[1] == 1:
+        (c1, m1) = (c0, numpy.zeros(len(values), dtype=bool))
+    else:
+        (c1, m1) = (data[:, 1], mask[:, 1])
+    single = (lengths == 1) & m0 & (values == c0)
+    ranged = (lengths > 1) & (~m0 | (values >= c0)) & (~m1 | (values <= c1))
+    return single | ranged
+
+class BatchPulse:
+    def __init__(self, run, node):
+        self.run = run
+
+class BSprayer(BatchPulse):
+    def __init__(self, run, node):
+        BatchPulse.__init__(self, run, node)
+        self.targets = [run.pulse(p) for p in node.targets()]
+
+    def fire(self, values, active):
+        for p in self.targets: p.fire(values, active)
+
+class BCycler(BatchPulse):
+    def __init__(self, run, node):
+        BatchPulse.__init__(self, run, node)
+        sources = [run.chain(c) for c in node.sources()]
+        self.chain = sources[0]
+        self.conditions = sources[1:]       # firstIf, nextIf, loopIf
+        (self.out,) = [run.pulse(p) for p in node.targets()]
+        self.counter = numpy.repeat(node.getState(), run.size).astype(numpy.int64)
+
+    def fire(self, values, active):
+        (data, mask, length) = self.chain.value()
+        active = active & (length > 0)
+        if not active.any(): return
+        (firstIf, nextIf, loopIf) = self.conditions
+        counter = self.counter
+
+        first = active & inRange(values, firstIf)
+        counter[first] = 0
+        following = active & ~first & inRange(values, nextIf)
+        counter[following] += 1
+        within = following & (counter < length)
+        loop = following & ~within & inRange(values, loopIf)
+        counter[loop] %= length[loop]
+
+        firing = first | within | loop
+        if data.shape[1] == 0 or not firing.any(): return
+        safe = numpy.minimum(counter, data.shape[1] - 1)
+        rows = numpy.arange(len(counter))
+        present = firing & (counter < length) & mask[rows, safe]
+        self.out.fire(data[rows, safe], present)
+
+class BHolder(BatchPulse):
+    """
+    A MidiIntHolder's value per lane, and whether it has one: a holder
+    can start out holding None, which is what an Outputter then emits.
+
+    >>> from core.interfacing import Outputter
+    >>> def graph(c, sink):
+    ...     out = Outputter(sink, c, None, 100, 50)
+    ...     notes = Cycler(c, '345', out.pitch, firstIf=1, nextIf='..', loopIf='..')
+    ...     return Cycler(c, '11', Sprayer(c, out.emit, notes), firstIf=0, nextIf='..', loopIf='..')
+    >>> renderLanes(graph, [1, 2], 3).events(1)
+    [(0, 0, None, 100, 50), (1, 0, 3, 100, 50), (2, 0, 3, 100, 50)]
+    """
+    def __init__(self, run, node):
+        BatchPulse.__init__(self, run, node)
+        initial = node.get()
+        self.value = numpy.repeat(0 if initial is None else initial, run.size).astype(numpy.int64)
+        self.present = numpy.repeat(initial is not None, run.size)
+
+    def fire(self, values, active):
+        self.value = numpy.where(active, values, self.value)
+        self.present = self.present | active
+
+class BEmit(BatchPulse):
+    def __init__(self, run, node):
+        BatchPulse.__init__(self, run, node)
+        # Pitch, velocity and duration:
+        self.holders = [run.pulse(h) for h in node.targets()]
+
+    def fire(self, values, active):
+        holders = self.holders
+        if all([h.present.all() for h in holders]):
+            present = None
+        else:
+            present = [h.present for h in holders]
+        self.run.record(0, active, *[h.value for h in holders], **{'present': present})
+
+class BCtrl(BatchPulse):
+    def __init__(self, run, node):
+        BatchPulse.__init__(self, run, node)
+        self.cc = node.controller()
+
+    def fire(self, values, active):
+        n = len(values)
+        self.run.record(1, active, numpy.repeat(self.cc, n), values, numpy.zeros(n, dtype=numpy.int64))
+
+PULSES = [(Sprayer, BSprayer),
+          (Cycler, BCycler),
+          (MidiIntHolder, BHolder),
+          (OutputterPulse, BEmit),
+          (CtrlOutput, BCtrl)]
+
+class LaneRun:
+    """
+    A graph, from its root pulse, translated for evaluation over
+    one lane per seed.
+
+    >>> from core.render import render
+    >>> from core.batch import renderVariation
+    >>> from core.interfacing import Outputter
+    >>> def graph(c, sink, width=4):
+    ...     out = Outputter(sink, c, 0, 100, 100)
+    ...     table = Assembler(c, 59, 61, 64, Ranger(c, [2, 12]))
+    ...     pitches = Transposer(c, Indexer(c, table, Ranger(c, [width, 5])), 12)
+    ...     pattern = Selector(c, Ranger(c, 2), '1.1.', Ranger(c, [4, 2]))
+    ...     notes = Cycler(c, pitches, out.pitch, firstIf=1, nextIf='..', loopIf='..')
+    ...     fan = Sprayer(c, notes, out.emit, CtrlOutput(sink, c, 7))
+    ...     return Cycler(c, pattern, fan, firstIf=0, nextIf='..', loopIf='..')
+    >>> def plain(seed, **params):
+    ...     return list(renderVariation(graph, seed, params, 96, wrap=32).events())
+
+    >>> seeds = range(100, 140)
+    >>> run = renderLanes(graph, seeds, 96, wrap=32)
+    >>> run.counts().sum() > 0
+    True
+    >>> [run.events(b) == plain(s) for (b, s) in enumerate(seeds)] == [True] * len(seeds)
+    True
+    >>> run = renderLanes(graph, [5, 6, 7], 96, wrap=32, params={'width': 6})
+    >>> [run.events(b) == plain(s, width=6) for (b, s) in enumerate([5, 6, 7])]
+    [True, True, True]
+
+    Graphs with other nodes are rejected:
+
+    >>> from core.basis import Pulse
+    >>> LaneRun(Cycler(Context(), '1', Pulse(None)), [1, 2])
+    Traceback (most recent call last):
+    ...
+    TypeError: can't batch Pulse
+    """
+    def __init__(self, root, seeds):
+        if numpy is None:
+            raise ImportError("batched evaluation needs NumPy")
+        self.seeds = numpy.array([s & MASK for s in seeds], dtype=numpy.uint64)
+        self.size = len(seeds)
+        self.tick = -1
+        self.__nodes = {}
+        self.__events = []
+        self.__root = self.pulse(root)
+
+    def chain(self, node):
+        key = id(node)
+        if key not in self.__nodes:
+            for (cls, batched) in CHAINS:
+                if isinstance(node, cls):
+                    self.__nodes[key] = batched(self, node)
+                    break
+            else:
+                if isinstance(node, SCALARS) or node.isStatic():
+                    self.__nodes[key] = Scalar(self, node)
+                else:
+                    raise TypeError("can't batch " + node.__class__.__name__)
+        return self.__nodes[key]
+
+    def pulse(self, node):
+        key = id(node)
+        if key not in self.__nodes:
+            if node.policy() != Pulse.EVERY:
+                raise ValueError("can't batch the %s policy" % node.policy())
+            for (cls, batched) in PULSES:
+                if isinstance(node, cls):
+                    self.__nodes[key] = batched(self, node)
+                    break
+            else:
+                raise TypeError("can't batch " + node.__class__.__name__)
+        return self.__nodes[key]
+
+    def record(self, outlet, active, a, b, c, present=None):
+        """
+        Record an event in the active lanes. `present`, if given, says
+        which of a, b and c hold a value (rather than None) per lane.
+        """
+        lanes = numpy.flatnonzero(active)
+        if len(lanes):
+            if present is not None: present = [p[lanes] for p in present]
+            self.__events.append((self.tick, outlet, lanes, a[lanes], b[lanes], c[lanes], present))
+
+    def clock(self, i):
+        """
+        One tick: fire the root with clock count `i` in every lane.
+        """
+        self.tick += 1
+        self.__root.fire(numpy.repeat(i, self.size).astype(numpy.int64),
+                         numpy.ones(self.size, dtype=bool))
+
+    def run(self, ticks, wrap=None):
+        for n in xrange(self.tick + 1, self.tick + 1 + ticks):
+            if wrap is None:
+                self.clock(n)
+            else:
+                self.clock(n % wrap)
+
+    def counts(self):
+        """
+        The number of events in each lane.
+        """
+        counts = numpy.zeros(self.size, dtype=numpy.int64)
+        for (_, _, lanes, _, _, _, _) in self.__events:
+            counts[lanes] += 1
+        return counts
+
+    def events(self, lane):
+        """
+        One lane's events, in the form of EventBuffer.events().
+        """
+        result = []
+        for (tick, outlet, lanes, a, b, c, present) in self.__events:
+            j = numpy.searchsorted(lanes, lane)
+            if j < len(lanes) and lanes[j] == lane:
+                values = [int(a[j]), int(b[j]), int(c[j])]
+                if present is not None:
+                    values = [v if p[j] else None for (v, p) in zip(values, present)]
+                result.append(tuple([tick, outlet] + values))
+        return result
+
+def renderLanes(factory, seeds, ticks, wrap=None, params=None):
+    """
+    Build a graph from a factory (see core.batch) and run it for
+    `ticks` ticks in one lane per seed, returning the LaneRun.
+    """
+    if params is None: params = {}
+    context = Context(seed=0)
+    # The graph's own sink is never sent anything:
+    root = factory(context, EventBuffer(), **params)
+    run = LaneRun(root, seeds)
+    run.run(ticks, wrap=wrap)
+    return run
+
+if __name__ == "__main__":
+    import sys
+    if numpy is None:
+        sys.stderr.write("NumPy not available: skipping lib.batched tests\n")
+        sys.exit(0)
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -4,6 +4,8 @@ Library chain generators and combination functions.
 $Id: chains.py,v 82acc1b558e6 2011/03/23 22:03:28 nick $
 '''
 
+from bisect import bisect_right
+
 from core.basis import Chain
 from core.derived import wrap
 
@@ -11,7 +13,15 @@ class Assembler(Chain):
     """
     A chain whose arguments are constants (each wrapped into
     a ConstChain) or objects which are assumed to be chains.
+    Element k is found lazily through the running totals of the
+    children's lengths.
     """
+    __slots__ = ('__chains', '__endsStamp', '__ends')
+
+    VOLATILE = False
+    MUTABLE = False
+    LAZY = True
+
     def __init__(self, context, *values):
         """
         >>> from const import C
@@ -20,11 +30,62 @@ class Assembler(Chain):
         >>> c[0]
         Called get()
         Called get()
-        Called get()
         99
         """
         Chain.__init__(self, context)
         self.__chains = [wrap(context, v) for v in values]
+        self.__endsStamp = None
+        self.__ends = None
+
+    def sources(self):
+        return self.__chains
+
+    def __childEnds(self):
+        stamp = self._Chain__context.get()
+        if stamp != self.__endsStamp:
+            ends = []
+            total = 0
+            for c in self.__chains:
+                total += c.length()
+                ends.append(total)
+            self.__ends = ends
+            self.__endsStamp = stamp
+        return self.__ends
+
+    def lazyLength(self):
+        ends = self.__childEnds()
+        return ends[-1] if ends else 0
+
+    def lazyItem(self, key):
+        """
+        >>> from core.basis import Context
+        >>> c = Context()
+        >>> a = Assembler(c, Ranger(c, [3, 1]), [], Atom(c, default=5), '6.7')
+        >>> a.LAZY_MIN = 0
+        >>> c.tick()
+        >>> a.values()
+        (0, 0, 0, 5, 6, None, 7)
+        >>> c.tick()
+        >>> a.length(), [a[k] for k in range(7)]
+        (7, [0, 0, 0, 5, 6, None, 7])
+        >>> a._Chain__lastStamp < c.get()
+        True
+
+        A long chain is looked at lazily after its first tick:
+
+        >>> long = Assembler(c, [7] * 200, Ranger(c, [10, 3]))
+        >>> c.tick()
+        >>> long.length()
+        210
+        >>> c.tick()
+        >>> long[205] < 3, long._Chain__lastStamp < c.get()
+        (True, True)
+        """
+        ends = self.__childEnds()
+        j = bisect_right(ends, key)
+        if j == len(ends): return None
+        start = ends[j - 1] if j > 0 else 0
+        return self.__chains[j][key - start]
 
     def instance(self):
         """
@@ -33,7 +94,6 @@ class Assembler(Chain):
         >>> c0 = Assembler(context, None)
         >>> {'a' : c0[0]}
         Called get()
-        ...
         Called get()
         {'a': None}
 
@@ -59,7 +119,7 @@ class Assembler(Chain):
         """
         result = []
         for c in self.__chains:
-            result += [c[i] for i in range(c.length())]
+            result.extend(c.values())
         return result
 
 class Atom(Chain):
@@ -67,6 +127,10 @@ class Atom(Chain):
     This is a chain with a single integer value, added using `set`.
     The optional keyword argument `default` sets the initial value.
     """
+    __slots__ = ('__value',)
+
+    VOLATILE = False
+
     def __init__(self, context, **kw):
         Chain.__init__(self, context)
         if 'default' in kw:
@@ -76,6 +140,7 @@ class Atom(Chain):
 
     def set(self, value):
         self.__value = value
+        self.invalidate()
 
     def instance(self):
         """
@@ -101,11 +166,29 @@ class Transposer(Chain):
     Transposer(c1, c2): c1 is transposed by c2[0], if the
     latter exists and is not None.
     """
+    __slots__ = ('__sourceChain', '__xposeChain')
+
+    VOLATILE = False
+    MUTABLE = False
+    LAZY = True
+
     def __init__(self, context, sourceChain, xposeChain):
         Chain.__init__(self, context)
         self.__sourceChain = wrap(context, sourceChain)
         self.__xposeChain = wrap(context, xposeChain)
 
+    def sources(self):
+        return [self.__sourceChain, self.__xposeChain]
+
+    def lazyLength(self):
+        return self.__sourceChain.length()
+
+    def lazyItem(self, key):
+        x = self.__sourceChain[key]
+        if x is None: return None
+        v = self.__xposeChain[0]
+        return x if v is None else x + v
+
     def instance(self):
         """
         >>> from const import C
@@ -125,11 +208,7 @@ class Transposer(Chain):
         """
         v = self.__xposeChain[0]
         if v is None: v = 0
-        result = []
-        for i in range(self.__sourceChain.length()):
-            x = self.__sourceChain[i]
-            result.append(None if x is None else x + v)
-        return result
+        return [None if x is None else x + v for x in self.__sourceChain.values()]
 
 class Ranger(Chain):
     """
@@ -142,56 +221,112 @@ class Ranger(Chain):
     as [1, value] - randomised chains of length 1
     are quite useful.
     """
+    __slots__ = ('__params', '__key')
+
+    LAZY = True
+
     def __init__(self, context, params):
         Chain.__init__(self, context)
         self.__params = wrap(context, params)
+        self.__key = context.newKey()
+
+    def sources(self):
+        return [self.__params]
+
+    def key(self):
+        """
+        The key this chain draws its random values with (see Context.rand).
+        """
+        return self.__key
+
+    def __shape(self):
+        params = self.__params
+        n = params.length()
+        if n == 1:
+            (n, lim) = (1, params[0])
+        elif n > 1:
+            (n, lim) = (params[0], params[1])
+        else:
+            (n, lim) = (None, None)
+        if n is None or n < 0: n = 0
+        return (n, lim)
+
+    def lazyLength(self):
+        return self.__shape()[0]
+
+    def lazyItem(self, key):
+        """
+        Element k alone, the same as in the full instance.
+        >>> from core.basis import Context
+        >>> c = Context(seed=4)
+        >>> r = Ranger(c, [6, 100])
+        >>> r.LAZY_MIN = 0
+        >>> c.tick()
+        >>> r.values() is not None
+        True
+        >>> c.tick()
+        >>> (r.length(), [r[k] for k in range(7)])
+        (6, [...None])
+        >>> tuple([r[k] for k in range(6)]) == r.values()
+        True
+        """
+        (n, lim) = self.__shape()
+        if key >= n or lim is None or lim <= 0:
+            return None
+        else:
+            return self._Chain__context.rand(lim, self.__key, key)
 
     def instance(self):
         """
         >>> from const import C
-        >>> context = C(get=Mock('get', returns=1), rand=Mock('rand', returns_iter=[1, 5, 2, 7, 9]))
+        >>> context = C(get=Mock('get', returns=1), newKey=Mock('newKey', returns=4),
+        ...             rands=Mock('rands', returns=[1, 5, 2, 7, 9]))
         >>> print Ranger(context, [5, 10])
+        Called newKey()
         Called get()
         ...
-        Called rand(10)
-        ...
+        Called rands(10, 4, 5)
         [1 5 2 7 9]
-        >>> context = C(get=Mock('get', returns=1), rand=Mock('rand', returns_iter=[]))
+        >>> context = C(get=Mock('get', returns=1), newKey=Mock('newKey', returns=4))
         >>> print Ranger(context, [1, 0])
+        Called newKey()
         Called get()
         ...
         [.]
-        >>> context = C(get=Mock('get', returns=1), rand=Mock('rand', returns_iter=[]))
         >>> print Ranger(context, [1, None])
+        Called newKey()
         Called get()
         ...
         [.]
-        >>> context = C(get=Mock('get', returns=1), rand=Mock('rand', returns_iter=[]))
         >>> print Ranger(context, [None, 14])
+        Called newKey()
         Called get()
         ...
         []
-        >>> context = C(get=Mock('get', returns=1), rand=Mock('rand', returns_iter=[7]))
+        >>> context = C(get=Mock('get', returns=1), newKey=Mock('newKey', returns=4),
+        ...             rands=Mock('rands', returns=[7]))
         >>> print Ranger(context, [14])
+        Called newKey()
         Called get()
         ...
+        Called rands(14, 4, 1)
         [7]
         """
-        len = self.__params[0]
-        lim = self.__params[1]
-
-        if self.__params.length() == 1:
-            lim = len
-            len = 1
-
-        if len is None or len < 0: len = 0
-        return [self.__random(lim) for i in range(len)]
+        params = self.__params.values()
+        if len(params) == 1:
+            (n, lim) = (1, params[0])
+        elif len(params) > 1:
+            (n, lim) = params[:2]
+        else:
+            (n, lim) = (None, None)
 
-    def __random(self, lim):
-        if lim is None or lim <= 0:
-            return None
+        if n is None or n < 0: n = 0
+        if n == 0:
+            return []
+        elif lim is None or lim <= 0:
+            return [None] * n
         else:
-            return self._Chain__context.rand(lim)
+            return self._Chain__context.rands(lim, self.__key, n)
 
 class Indexer(Chain):
     """
@@ -199,11 +334,28 @@ class Indexer(Chain):
     as indices, where each element is values[i] for indices
     value i. Value is None where i is None, i < 0, or i >= len(values).
     """
+    __slots__ = ('__values', '__indices')
+
+    VOLATILE = False
+    MUTABLE = False
+    LAZY = True
+
     def __init__(self, context, values, indices):
         Chain.__init__(self, context)
         self.__values = wrap(context, values)
         self.__indices = wrap(context, indices)
 
+    def sources(self):
+        return [self.__values, self.__indices]
+
+    def lazyLength(self):
+        return self.__indices.length()
+
+    def lazyItem(self, key):
+        i = self.__indices[key]
+        if i is None: return None
+        return self.__values[i]
+
     def instance(self):
         """
         >>> from const import C
@@ -217,22 +369,54 @@ class Indexer(Chain):
         ...
         [7 . 8 . . . 8 . 9 . 7]
         """
-        return [self.__calc(self.__indices[i]) for i in range(self.__indices.length())]
-
-    def __calc(self, offset):
-        return None if offset is None else self.__values[offset]
+        values = self.__values.values()
+        n = len(values)
+        return [None if i is None or i < 0 or i >= n else values[i]
+                for i in self.__indices.values()]
 
 class Selector(Chain):
     """
     Selector(s, c1 ... cn) returns one of c1, ..., cn per
     tick. depending on s[0] (from 0 to n-1). (This is why idempotence
     is important.) If s[0] is None or < 0 or >= n, returns [].
+    The selection is only rebuilt when s, or the chosen chain, changes.
     """
+    __slots__ = ('__index', '__chains')
+
+    VOLATILE = False
+    MUTABLE = False
+    LAZY = True
+
     def __init__(self, context, index, *chains):
         Chain.__init__(self, context)
         self.__index = wrap(context, index)
         self.__chains = [wrap(context, c) for c in chains]
 
+    def sources(self):
+        return [self.__index] + self.__chains
+
+    def dependencies(self):
+        chain = self.__chosen()
+        if chain is None:
+            return [self.__index]
+        else:
+            return [self.__index, chain]
+
+    def lazyLength(self):
+        chain = self.__chosen()
+        return 0 if chain is None else chain.length()
+
+    def lazyItem(self, key):
+        chain = self.__chosen()
+        return None if chain is None else chain[key]
+
+    def __chosen(self):
+        idx = self.__index[0]
+        if idx is None or idx < 0 or idx >= len(self.__chains):
+            return None
+        else:
+            return self.__chains[idx]
+
     def instance(self):
         """
         >>> from const import C
@@ -253,13 +437,28 @@ class Selector(Chain):
         Called get()
         ...
         []
+
+        >>> from core.basis import Context
+        >>> context = Context()
+        >>> a = Atom(context, default=0)
+        >>> s = Selector(context, a, [6, 7], Ranger(context, [3, 10]))
+        >>> context.tick()
+        >>> print s
+        [6 7]
+        >>> v = s.version()
+        >>> context.tick()
+        >>> s.version() == v
+        True
+        >>> a.set(1)
+        >>> context.tick()
+        >>> s.version() == v
+        False
         """
-        idx = self.__index[0]
-        if idx is None or idx < 0 or idx >= len(self.__chains):
-            return []
+        chain = self.__chosen()
+        if chain is None:
+            return ()
         else:
-            chain = self.__chains[idx]
-            return [chain[i] for i in range(chain.length())]
+            return chain.values()
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,140 @@
+'''
+Hash-consing of chains: a NodeFactory builds chains as the constructors
+in lib.chains do, but returns the existing node when asked for one
+structurally identical to a node it has already built, so that copies
+across voices are evaluated once per tick rather than once each.
+
+Only deterministic chains (neither VOLATILE nor MUTABLE: Assemblers,
+Transposers, Indexers, Selectors, and Consts for literals) are shared;
+Rangers, Atoms and the like are always built afresh.
+
+    f = NodeFactory(c)
+    P0 = f.Assembler(59, 61, 64, 54, 66)
+    voice1 = f.Transposer(P0, 12)
+    voice2 = f.Transposer(P0, 12)       # the same node as voice1
+'''
+
+from core.manifest import *
+from core.basis import Chain, Const
+from core.util import literal
+from lib.chains import Assembler, Atom, Transposer, Ranger, Indexer, Selector
+
+class NodeFactory:
+    """
+    >>> from core.basis import Context
+    >>> c = Context(fold=False)
+    >>> f = NodeFactory(c)
+    >>> P0 = f.Assembler(59, 61, 64)
+    >>> f.Transposer(P0, 12) is f.Transposer(P0, 12)
+    True
+    >>> f.Transposer(P0, 12) is f.Transposer(P0, 7)
+    False
+    >>> f.Assembler('1.1100..') is f.Assembler([1, None, 1, 1, 0, 0, None, None])
+    True
+    >>> f.Transposer(f.Assembler(1, 2), 3) is f.Transposer(f.Assembler([1, 2]), '3')
+    False
+    >>> f.merged()
+    4
+
+    Random and mutable chains stay distinct:
+
+    >>> f.Ranger([4, 12]) is f.Ranger([4, 12])
+    False
+    >>> f.Atom(default=3) is f.Atom(default=3)
+    False
+    >>> f.merged()
+    5
+
+    Shared nodes are only evaluated once:
+
+    >>> r = f.Ranger([2, 10])
+    >>> voices = [f.Transposer(f.Selector(0, r, P0), 60) for i in range(4)]
+    >>> c.tick()
+    >>> len(set([id(v) for v in voices])), voices[0].values() == voices[3].values()
+    (1, True)
+    """
+    def __init__(self, context):
+        self.__context = context
+        self.__nodes = {}
+        self.__merged = 0
+
+    def __key(self, item):
+        if isinstance(item, Chain):
+            return ('chain', id(item))
+        elif type(item) in [STRING_type, LIST_type, INTEGER_type, NONE_type]:
+            return ('literal', literal(item))
+        else:
+            return None
+
+    def wrap(self, item):
+        """
+        As core.derived.wrap, but with one Const per distinct literal.
+        """
+        if type(item) in [STRING_type, LIST_type, INTEGER_type, NONE_type]:
+            return self.make(Const, item)
+        else:
+            return item
+
+    def make(self, cls, *args, **kw):
+        """
+        Build `cls(context, *args, **kw)`, or return the node already
+        built from the same class and arguments. Literal arguments are
+        compared by value (and shared as Consts), chains by identity.
+        """
+        if cls.VOLATILE or cls.MUTABLE:
+            return cls(self.__context, *args, **kw)
+
+        keys = [self.__key(a) for a in args] + \
+               [(k, self.__key(v)) for (k, v) in sorted(kw.items())]
+        if None in keys or None in [k for (_, k) in keys[len(args):]]:
+            return cls(self.__context, *args, **kw)
+
+        key = (cls, tuple(keys))
+        node = self.__nodes.get(key)
+        if node is None:
+            if cls is not Const:
+                args = [self.wrap(a) for a in args]
+            node = cls(self.__context, *args, **kw)
+            self.__nodes[key] = node
+        else:
+            self.__merged += 1
+        return node
+
+    def merged(self):
+        """
+        How many requests for a node were met by an existing one.
+        """
+        return self.__merged
+
+    def nodes(self):
+        """
+        How many distinct shared nodes have been built.
+        """
+        return len(self.__nodes)
+
+    def Assembler(self, *values):
+        return self.make(Assembler, *values)
+
+    def Transposer(self, sourceChain, xposeChain):
+        return self.make(Transposer, sourceChain, xposeChain)
+
+    def Indexer(self, values, indices):
+        return self.make(Indexer, values, indices)
+
+    def Selector(self, index, *chains):
+        return self.make(Selector, index, *chains)
+
+    def Ranger(self, params):
+        return self.make(Ranger, self.wrap(params))
+
+    def Atom(self, **kw):
+        return self.make(Atom, **kw)
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
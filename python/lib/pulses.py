@@ -8,6 +8,8 @@ from core.basis import Pulse, Const
 from core.derived import wrap
 
 class Sprayer(Pulse):
+    __slots__ = ('__pulses',)
+
     def __init__(self, context, *pulses):
         """
         >>> from const import C
@@ -21,9 +23,44 @@ class Sprayer(Pulse):
         Pulse.__init__(self, context)
         self.__pulses = list(pulses)
 
+    def targets(self):
+        return self.__pulses
+
     def doFire(self, i):
         for p in self.__pulses: p.fire(i)
 
+def never(value):
+    return False
+
+def rangePredicate(values):
+    """
+    Compile the values of a Cycler condition chain (see below) into a
+    predicate on the incoming value.
+
+    >>> [rangePredicate(c)(5) for c in [(), (None,), (5,), (4,), (None, None), (5, None), (None, 4), (3, 7)]]
+    [False, False, True, False, True, True, False, True]
+    >>> [rangePredicate(c)(v) for (v, c) in [(2, (1, 3)), (3, (1, 2)), (None, (1, 2)), (37, (0, None)),
+    ...                                       (6, (None, 9)), (37, (37,)), (37, (36,)), (2, (1, 3, 0))]]
+    [True, False, False, True, True, True, False, True]
+    >>> rangePredicate((None, None))(None), rangePredicate((None,))(None)
+    (False, False)
+    """
+    if len(values) == 0 or (len(values) == 1 and values[0] is None):
+        return never
+    elif len(values) == 1:
+        target = values[0]
+        return lambda value: value == target
+    else:
+        (lo, hi) = values[:2]
+        if lo is None and hi is None:
+            return lambda value: value is not None
+        elif hi is None:
+            return lambda value: value is not None and value >= lo
+        elif lo is None:
+            return lambda value: value is not None and value <= hi
+        else:
+            return lambda value: value is not None and lo <= value <= hi
+
 class Cycler(Pulse):
     """
     Our full-on chain-cycling pulse. Runs along a chain,
@@ -47,7 +84,14 @@ class Cycler(Pulse):
     or j as open-ended. c[2] onwards ignored.
     If the keyword argument is totally absent, treat
     as [].
+
+    The conditions are compiled into predicates (see rangePredicate) on
+    first use: once only for static chains, and again whenever a
+    dynamic one changes value.
     """
+    __slots__ = ('__chain', '__outPulse', '__firstIf', '__nextIf', '__loopIf', '__counter',
+                 '__predicates')
+
     def __init__(self, context, chain, outPulse, **args):
         """
         >>> from const import C
@@ -55,7 +99,7 @@ class Cycler(Pulse):
         >>> pulse = C()
         >>> cycler = Cycler(context, '123', pulse, firstIf=99)
         >>> cycler._Cycler__chain
-        <core.basis.Const instance ...>
+        <core.basis.Const object ...>
         >>> print cycler._Cycler__firstIf
         Called get()
         [99]
@@ -81,56 +125,55 @@ class Cycler(Pulse):
         li = args.get('loopIf')
         self.__loopIf = wrap(context, li) if li is not None else Const(context, [])
         self.__counter = 0
+        self.__predicates = None
 
-    def __inRange(self, value, rangeChain):
+    def sources(self):
+        return [self.__chain, self.__firstIf, self.__nextIf, self.__loopIf]
+
+    def targets(self):
+        return [self.__outPulse]
+
+    def getState(self):
+        return self.__counter
+
+    def setState(self, state):
+        self.__counter = state
+
+    def __predicate(self, n):
         """
-        >>> from const import C
-        >>> context = C(get=Mock('get', returns=1))
-        >>> cycle = Cycler(context, None, None)
-        >>> cycle._Cycler__inRange(2, Const(context, ''))
-        Called get()
-        False
-        >>> cycle._Cycler__inRange(2, Const(context, [1, 3]))
-        Called get()
-        ...
-        True
-        >>> cycle._Cycler__inRange(3, Const(context, [1, 2]))
-        Called get()
-        ...
-        False
-        >>> cycle._Cycler__inRange(None, Const(context, [1, 2]))
-        False
-        >>> cycle._Cycler__inRange(37, Const(context, '0.'))
-        Called get()
-        ...
-        True
-        >>> cycle._Cycler__inRange(6, Const(context, '.9'))
-        Called get()
-        ...
-        True
-        >>> cycle._Cycler__inRange(6, Const(context, '..'))
-        Called get()
-        ...
-        True
-        >>> cycle._Cycler__inRange(37, Const(context, 37))
-        Called get()
-        ...
+        The compiled predicate for condition `n` (firstIf, nextIf, loopIf):
+
+        >>> from core.basis import Context
+        >>> from lib.chains import Atom
+        >>> c = Context()
+        >>> conditions = ['', [1, 3], '0.', '.9', '..', 6, 5, [None], Atom(c, default=6)]
+        >>> c.tick()
+        >>> [Cycler(c, None, None, firstIf=cond)._Cycler__predicate(0)(6) for cond in conditions]
+        [False, False, True, True, True, True, False, False, True]
+
+        Dynamic conditions are recompiled when they change:
+
+        >>> a = Atom(c, default=4)
+        >>> cycle = Cycler(c, None, None, firstIf=a)
+        >>> cycle._Cycler__predicate(0)(4)
         True
-        >>> cycle._Cycler__inRange(37, Const(context, 36))
-        Called get()
-        ...
-        False
+        >>> a.set(5)
+        >>> cycle._Cycler__predicate(0)(4), cycle._Cycler__predicate(0)(5)
+        (False, True)
         """
-        if value is None:
-            return False
-        elif rangeChain.length() == 0:
-            return False
-        elif rangeChain.length() == 1:
-            return (value == rangeChain[0])
-        else:
-            lo = rangeChain[0]
-            hi = rangeChain[1]
-            return (lo is None or value >= lo) and (hi is None or value <= hi)
+        if self.__predicates is None:
+            self.__predicates = [[chain, chain.isStatic(), None, None]
+                                 for chain in [self.__firstIf, self.__nextIf, self.__loopIf]]
+        entry = self.__predicates[n]
+        (chain, static, version, predicate) = entry
+        if predicate is not None and static:
+            return predicate
+        current = chain.version()
+        if predicate is None or current != version:
+            predicate = rangePredicate(chain.values())
+            entry[2] = current
+            entry[3] = predicate
+        return predicate
 
     def doFire(self, i):
         """
@@ -147,7 +190,6 @@ class Cycler(Pulse):
         ...
         >>> cycler.fire(2)
         Called get()
-        ...
         >>> cycler.fire(0)
         Called get()
         ...
@@ -169,15 +211,15 @@ class Cycler(Pulse):
         """
         length = self.__chain.length()
         if length > 0:
-            if self.__inRange(i, self.__firstIf):
+            if self.__predicate(0)(i):
                 self.__counter = 0
                 self.__doit()
-            elif self.__inRange(i, self.__nextIf):
+            elif self.__predicate(1)(i):
                 self.__counter += 1
 
                 if self.__counter < length:
                     self.__doit()
-                elif self.__inRange(i, self.__loopIf):
+                elif self.__predicate(2)(i):
                     self.__counter %= length
                     self.__doit()
 
@@ -0,0 +1,407 @@
+'''
+Loader for patches in the legacy Tangram text format (see
+tangram.fragment.txt): `pbind.*` pulse and `sbind.*` sequence
+definitions, built straight into lib.chains / lib.pulses graphs.
+
+Parsing and validation produce a compiled form - the build steps, in
+dependency order - which can be cached on disk, keyed by a hash of the
+file, so that a large library of patches loads quickly.
+
+Sequences:
+
+    name, sbind.assemble <arg> ...          Assembler
+    name, sbind.capture <int> ...           Assembler of literal values
+    name, sbind.transpose <arg> <arg>       Transposer
+    name, sbind.random <arg>                Ranger
+    name, sbind.select <arg> ...            Selector, choosing at random
+
+Pulses:
+
+    name, pbind.sequence <arg> <pulse> [<cond> [<cond> [<cond>]]]
+                                            Cycler (firstIf, nextIf, loopIf)
+    name, pbind.fanout <pulse> ...          Sprayer
+    name, pbind.emit <out> <ch> <pitch> <velocity> <duration>
+                                            Outputter `out`; this is its emit
+
+An <arg> is a sequence name, an integer, `const:<int>` or `spell:<digits
+and dots>`. A <pulse> is a pulse name, or `pitch:<out>`, `velocity:<out>`
+or `duration:<out>` for the parts of an Outputter. A <cond> is an <arg>,
+or `empty` (meaning always, as in the port of Tangram in main.py). The
+MIDI channel of `pbind.emit` is ignored: Outputters have a fixed outlet.
+'''
+
+import os
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from core.basis import Context
+from core.interfacing import Outputter
+from core.util import flatten
+from lib.chains import Assembler, Transposer, Ranger, Selector
+from lib.pulses import Sprayer, Cycler
+
+FORMAT = 'tangram-1'
+
+PORTS = ['pitch', 'velocity', 'duration']
+
+# Operation: (kind, minimum args, maximum args or None).
+OPS = {'sbind.assemble': ('s', 0, None),
+       'sbind.capture': ('s', 0, None),
+       'sbind.transpose': ('s', 2, 2),
+       'sbind.random': ('s', 1, 1),
+       'sbind.select': ('s', 1, None),
+       'pbind.sequence': ('p', 2, 5),
+       'pbind.fanout': ('p', 1, None),
+       'pbind.emit': ('p', 5, 5)}
+
+def parseArg(token):
+    """
+    >>> [parseArg(t) for t in ['P0', '59', '-3', 'const:7', 'spell:1.0', 'empty', 'pitch:notes']]
+    [('ref', 'P0'), ('int', 59), ('int', -3), ('int', 7), ('spell', '1.0'), ('empty',), ('port', 'pitch', 'notes')]
+    >>> parseArg('spell:1x')
+    Traceback (most recent call last):
+        ...
+    SyntaxError: 1x
+    """
+    if token == 'empty':
+        return ('empty',)
+    elif token.startswith('spell:'):
+        flatten(token[6:])
+        return ('spell', token[6:])
+    elif token.startswith('const:'):
+        return ('int', int(token[6:]))
+    elif ':' in token and token.split(':', 1)[0] in PORTS:
+        (port, name) = token.split(':', 1)
+        return ('port', port, name)
+    elif token.lstrip('-').isdigit():
+        return ('int', int(token))
+    else:
+        return ('ref', token)
+
+def tokenise(text):
+    """
+    Split the text into statements, each a list of tokens (without
+    the leading dots which show the nesting).
+    >>> tokenise('. [ T;\\n. . x, sbind.capture 1 2;\\n. ];')
+    [['[', 'T'], ['x,', 'sbind.capture', '1', '2'], [']']]
+    """
+    statements = []
+    for s in text.split(';'):
+        tokens = s.split()
+        while tokens and tokens[0].strip('.') == '':
+            tokens.pop(0)
+        if tokens: statements.append(tokens)
+    return statements
+
+def parse(text):
+    """
+    Parse and validate a patch, returning its compiled form:
+    (patch name, build steps in dependency order, root pulse names).
+    Each step is (kind, name, op, args), kind being 's' (sequence)
+    or 'p' (pulse).
+
+    >>> (name, steps, roots) = parse(open('../tangram.fragment.txt').read())
+    >>> name, roots
+    ('TangramFM', ['input'])
+    >>> [n for (_, n, _, _) in steps][:4]
+    ['prefix_1', 'prefix_2', 'prefix', 'tail_1']
+
+    >>> parse('[ T; [ sequences; a, sbind.transpose b 1; b, sbind.assemble a; ]; ];')
+    Traceback (most recent call last):
+        ...
+    SyntaxError: cycle through a
+    >>> parse('[ T; [ sequences; a, sbind.transpose b 1; ]; ];')
+    Traceback (most recent call last):
+        ...
+    SyntaxError: a: unknown sequence b
+    >>> parse('[ T; [ pulses; p, pbind.frob 1; ]; ];')
+    Traceback (most recent call last):
+        ...
+    SyntaxError: p: unknown operation pbind.frob
+    """
+    patchName = None
+    declared = {}
+    defs = {'s': {}, 'p': {}}
+    order = []
+    blocks = []
+
+    for tokens in tokenise(text):
+        if tokens[0] == '[':
+            if len(tokens) != 2: raise SyntaxError(' '.join(tokens))
+            if not blocks: patchName = tokens[1]
+            blocks.append(tokens[1])
+        elif tokens[0] == ']':
+            if not blocks: raise SyntaxError("unbalanced ]")
+            blocks.pop()
+        elif tokens[0].endswith(','):
+            name = tokens[0][:-1]
+            if len(blocks) == 1 and name in ['pnames', 'snames']:
+                declared[name[0]] = tokens[1:]
+                continue
+            if len(tokens) < 2 or tokens[1] not in OPS:
+                raise SyntaxError("%s: unknown operation %s" % (name, ' '.join(tokens[1:2])))
+            op = tokens[1]
+            (kind, lo, hi) = OPS[op]
+            args = tokens[2:]
+            if len(args) < lo or (hi is not None and len(args) > hi):
+                raise SyntaxError("%s: wrong number of arguments for %s" % (name, op))
+            if name in defs[kind]:
+                raise SyntaxError("%s: defined twice" % name)
+            defs[kind][name] = (op, [parseArg(a) for a in args])
+            order.append((kind, name))
+        else:
+            raise SyntaxError(' '.join(tokens))
+
+    if blocks: raise SyntaxError("unbalanced [")
+
+    for kind in declared:
+        if set(declared[kind]) != set(defs[kind].keys()):
+            raise SyntaxError("%snames does not match the definitions" % kind)
+
+    outputters = {}
+    for (name, (op, args)) in defs['p'].items():
+        if op == 'pbind.emit':
+            if args[0][0] != 'ref': raise SyntaxError("%s: bad outputter name" % name)
+            outputters[args[0][1]] = name
+
+    def dependencies(kind, name):
+        (op, args) = defs[kind][name]
+        result = []
+
+        def chain(arg, conditional=False):
+            if arg[0] == 'ref':
+                if arg[1] not in defs['s']:
+                    raise SyntaxError("%s: unknown sequence %s" % (name, arg[1]))
+                result.append(('s', arg[1]))
+            elif arg[0] == 'port' or (arg[0] == 'empty' and not conditional):
+                raise SyntaxError("%s: %s is not a sequence" % (name, arg[0]))
+
+        def pulse(arg):
+            if arg[0] == 'ref' and arg[1] in defs['p']:
+                result.append(('p', arg[1]))
+            elif arg[0] == 'port' and arg[2] in outputters:
+                result.append(('p', outputters[arg[2]]))
+            else:
+                raise SyntaxError("%s: unknown pulse %s" % (name, ':'.join(map(str, arg[1:]))))
+
+        if op == 'sbind.capture':
+            for a in args:
+                if a[0] != 'int': raise SyntaxError("%s: can only capture integers" % name)
+        elif kind == 's':
+            for a in args: chain(a)
+        elif op == 'pbind.sequence':
+            chain(args[0])
+            pulse(args[1])
+            for a in args[2:]: chain(a, conditional=True)
+        elif op == 'pbind.fanout':
+            for a in args: pulse(a)
+        elif op == 'pbind.emit':
+            for a in args[1:]:
+                if a[0] != 'int': raise SyntaxError("%s: emit needs integers" % name)
+        return result
+
+    # Depth-first topological sort, in order of definition:
+    steps = []
+    done = set()
+    inProgress = set()
+
+    def visit(node):
+        if node in done: return
+        if node in inProgress: raise SyntaxError("cycle through %s" % node[1])
+        inProgress.add(node)
+        for d in dependencies(*node): visit(d)
+        inProgress.remove(node)
+        done.add(node)
+        (op, args) = defs[node[0]][node[1]]
+        steps.append((node[0], node[1], op, args))
+
+    for node in order: visit(node)
+
+    targeted = set()
+    for (kind, name, op, args) in steps:
+        if kind == 'p':
+            for a in args:
+                if a[0] == 'ref' and a[1] in defs['p']: targeted.add(a[1])
+    roots = [name for (kind, name) in order if kind == 'p' and name not in targeted]
+
+    return (patchName, steps, roots)
+
+class Patch:
+    """
+    A loaded patch: its context, chains, pulses and outputters by name,
+    and its root pulses.
+    """
+    def __init__(self, name, context):
+        self.name = name
+        self.context = context
+        self.chains = {}
+        self.pulses = {}
+        self.outputters = {}
+        self.roots = []
+        self.fromCache = False
+
+    def clock(self, i):
+        """
+        The equivalent of `clock` in main.py, firing all the roots.
+        """
+        self.context.tick()
+        for name in self.roots: self.pulses[name].fire(i)
+        self.context.settle()
+
+def build(compiled, maxObject, context=None):
+    """
+    Build the graph for a compiled patch, with its Outputters talking
+    to `maxObject`.
+    """
+    (name, steps, roots) = compiled
+    if context is None: context = Context()
+    c = context
+    patch = Patch(name, c)
+
+    def chain(arg):
+        if arg[0] == 'ref': return patch.chains[arg[1]]
+        elif arg[0] == 'empty': return '..'
+        else: return arg[1]
+
+    def pulse(arg):
+        if arg[0] == 'ref': return patch.pulses[arg[1]]
+        else: return getattr(patch.outputters[arg[2]], arg[1])
+
+    for (kind, n, op, args) in steps:
+        if op == 'sbind.assemble' or op == 'sbind.capture':
+            patch.chains[n] = Assembler(c, *[chain(a) for a in args])
+        elif op == 'sbind.transpose':
+            patch.chains[n] = Transposer(c, chain(args[0]), chain(args[1]))
+        elif op == 'sbind.random':
+            patch.chains[n] = Ranger(c, chain(args[0]))
+        elif op == 'sbind.select':
+            patch.chains[n] = Selector(c, Ranger(c, len(args)), *[chain(a) for a in args])
+        elif op == 'pbind.sequence':
+            conditions = dict(zip(['firstIf', 'nextIf', 'loopIf'],
+                                  [chain(a) for a in args[2:]]))
+            patch.pulses[n] = Cycler(c, chain(args[0]), pulse(args[1]), **conditions)
+        elif op == 'pbind.fanout':
+            patch.pulses[n] = Sprayer(c, *[pulse(a) for a in args])
+        elif op == 'pbind.emit':
+            (_, pitch, velocity, duration) = [a[1] for a in args[1:]]
+            outputter = Outputter(maxObject, c, pitch, velocity, duration)
+            patch.outputters[args[0][1]] = outputter
+            patch.pulses[n] = outputter.emit
+
+    patch.roots = list(roots)
+    return patch
+
+def isCompiled(item):
+    """
+    Does this look like the compiled form of a patch (as from parse)?
+    >>> isCompiled(parse(open('../tangram.fragment.txt').read()))
+    True
+    >>> [isCompiled(x) for x in [1, ('P', [], ()), ('P', [('s', 'a', 'op')], [])]]
+    [False, False, False]
+    """
+    if type(item) is not tuple or len(item) != 3: return False
+    (name, steps, roots) = item
+    return (name is None or isinstance(name, str)) \
+        and type(steps) is list and type(roots) is list \
+        and all([type(s) is tuple and len(s) == 4 for s in steps]) \
+        and all([isinstance(r, str) for r in roots])
+
+def compilePatch(text, cacheDir=None):
+    """
+    Parse a patch, or fetch its compiled form from the cache directory.
+    Returns (compiled, fromCache). A cache file which can't be read, or
+    doesn't hold a compiled patch, is ignored (and replaced).
+
+    >>> import tempfile, shutil
+    >>> text = open('../tangram.fragment.txt').read()
+    >>> cache = tempfile.mkdtemp()
+    >>> (compiled, fromCache) = compilePatch(text, cache)
+    >>> [name] = os.listdir(cache)
+    >>> f = open(os.path.join(cache, name), 'wb')
+    >>> f.write('I1\\n.')
+    >>> f.close()
+    >>> compilePatch(text, cache) == (compiled, False)
+    True
+    >>> compilePatch(text, cache) == (compiled, True)
+    True
+    >>> shutil.rmtree(cache)
+    """
+    if cacheDir is None:
+        return (parse(text), False)
+
+    key = sha1(FORMAT + '\0' + text).hexdigest()
+    path = os.path.join(cacheDir, key + '.tgc')
+    try:
+        f = open(path, 'rb')
+        try:
+            cached = pickle.load(f)
+        finally:
+            f.close()
+        if isCompiled(cached): return (cached, True)
+    except Exception:
+        # No cache file, or one we can't unpickle: (re)build it.
+        pass
+
+    compiled = parse(text)
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    f = open(temp, 'wb')
+    try:
+        pickle.dump(compiled, f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(temp, path)
+    return (compiled, False)
+
+def load(path, maxObject, context=None, cacheDir=None):
+    """
+    Load a patch file and build it.
+
+    >>> import tempfile, shutil
+    >>> from core.render import EventBuffer, render
+    >>> cache = tempfile.mkdtemp()
+    >>> buf = EventBuffer()
+    >>> patch = load('../tangram.fragment.txt', buf, Context(seed=1), cacheDir=cache)
+    >>> patch.fromCache
+    False
+    >>> print patch.chains['P']
+    [59 61 64 54 66 66 68 71 61 73 71 73 76 66 78]
+    >>> sorted(patch.outputters.keys()), patch.roots
+    (['notes'], ['input'])
+    >>> render(patch.context, patch.pulses['input'], buf, 64)
+    >>> len(buf) > 0
+    True
+
+    >>> again = EventBuffer()
+    >>> patch = load('../tangram.fragment.txt', again, Context(seed=1), cacheDir=cache)
+    >>> patch.fromCache
+    True
+    >>> render(patch.context, patch.pulses['input'], again, 64)
+    >>> list(again.events()) == list(buf.events())
+    True
+    >>> shutil.rmtree(cache)
+    """
+    f = open(path)
+    try:
+        text = f.read()
+    finally:
+        f.close()
+    (compiled, fromCache) = compilePatch(text, cacheDir)
+    patch = build(compiled, maxObject, context)
+    patch.fromCache = fromCache
+    return patch
+
+if __name__ == "__main__":
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
@@ -0,0 +1,368 @@
+'''
+Array-backed chains: NumPy versions of the combinators in lib.chains,
+for chains which are thousands of elements long (pitch tables,
+probability maps). Each holds its value as an integer array plus a
+boolean validity mask (False where the chain has an empty slot), and
+combines its inputs' arrays without per-element Python loops.
+
+They are ordinary chains as far as everything else is concerned, so
+they can be mixed freely with the scalar ones; inputs which aren't
+array-backed are converted (once, if they're static).
+
+NumPy is optional: without it, this module imports but its chains
+can't be constructed.
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from core.basis import Chain, stream, GOLDEN
+from core.derived import wrap
+
+def fromValues(values):
+    """
+    >>> (d, m) = fromValues([3, None, 5])
+    >>> d.tolist(), m.tolist()
+    ([3, 0, 5], [True, False, True])
+    """
+    mask = numpy.array([v is not None for v in values], dtype=bool)
+    data = numpy.array([0 if v is None else v for v in values], dtype=numpy.int64)
+    return (data, mask)
+
+def toValues(data, mask):
+    """
+    >>> toValues(numpy.array([3, 0, 5]), numpy.array([True, False, True]))
+    [3, None, 5]
+    """
+    result = data.tolist()
+    for i in numpy.flatnonzero(~mask).tolist():
+        result[i] = None
+    return result
+
+def mixArray(x):
+    """
+    core.basis.mix64 over an array of uint64: this is the one vector
+    form of the context's random number generator.
+    >>> from core.basis import mix64
+    >>> mixArray(numpy.array([0, 1, 2**63], dtype=numpy.uint64)).tolist() == \\
+    ...     [mix64(0), mix64(1), mix64(2**63)]
+    True
+    """
+    u = numpy.uint64
+    x = (x ^ (x >> u(30))) * u(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> u(27))) * u(0x94D049BB133111EB)
+    return x ^ (x >> u(31))
+
+def absorbArray(h, v):
+    """
+    core.basis.absorb over uint64 arrays (or scalars), broadcasting.
+    """
+    return mixArray((numpy.uint64(h) ^ v) + numpy.uint64(GOLDEN))
+
+def counterRandoms(base, n):
+    """
+    The vector form of `core.basis.absorb(base, i)` for i from 0 to n-1.
+    >>> from core.basis import absorb
+    >>> counterRandoms(12345, 3).tolist() == [absorb(12345, i) for i in range(3)]
+    True
+    """
+    return absorbArray(base, numpy.arange(n, dtype=numpy.uint64))
+
+def empty():
+    return (numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool))
+
+class ArrayChain(Chain):
+    """
+    Base class: subclasses provide `compute()`, returning a (data, mask)
+    pair of arrays. The arrays are the chain's cached value: they are
+    shared, so they are made read-only, and the version only changes
+    when their contents do. The values as Python objects are only made
+    when asked for, by `values()` or `str()`.
+
+    >>> from core.basis import Context
+    >>> c = Context()
+    >>> a = VTransposer(c, VRanger(c, [5000, 3]), 0)
+    >>> t = VTransposer(c, a, 1)
+    >>> c.tick()
+    >>> (t.length(), t[4999] in [1, 2, 3], t._ArrayChain__values)
+    (5000, True, None)
+    >>> len(t.values()), t.values() is t.values()
+    (5000, True)
+    """
+    __slots__ = ('__arrays', '__values')
+
+    VOLATILE = False
+    MUTABLE = False
+
+    def __init__(self, context):
+        if numpy is None:
+            raise ImportError("array-backed chains need NumPy")
+        Chain.__init__(self, context)
+        self.__arrays = None
+        self.__values = None
+
+    def compute(self):
+        return empty()
+
+    def instance(self):
+        (data, mask) = self.compute()
+        data.flags.writeable = False
+        mask.flags.writeable = False
+        return (data, mask)
+
+    def refresh(self):
+        (data, mask) = self.instance()
+        old = self.__arrays
+        if old is not None and numpy.array_equal(data, old[0]) \
+                           and numpy.array_equal(mask, old[1]):
+            return False
+        self.__arrays = (data, mask)
+        self.__values = None
+        return True
+
+    def arrays(self):
+        """
+        The current (data, mask) pair.
+        """
+        self.version()
+        return self.__arrays
+
+    def length(self):
+        return len(self.arrays()[0])
+
+    def values(self):
+        arrays = self.arrays()
+        if self.__values is None:
+            self.__values = tuple(toValues(*arrays))
+        return self.__values
+
+    def __getitem__(self, key):
+        (data, mask) = self.arrays()
+        if key < 0 or key >= len(data) or not mask[key]:
+            return None
+        else:
+            return int(data[key])
+
+class Vectorised(ArrayChain):
+    """
+    Adapter presenting any chain as an array-backed one.
+    """
+    __slots__ = ('__chain',)
+
+    def __init__(self, context, chain):
+        ArrayChain.__init__(self, context)
+        self.__chain = chain
+
+    def sources(self):
+        return [self.__chain]
+
+    def compute(self):
+        return fromValues(self.__chain.values())
+
+def vwrap(context, item):
+    """
+    Like `wrap`, but always returns an array-backed chain.
+    """
+    chain = wrap(context, item)
+    if isinstance(chain, ArrayChain):
+        return chain
+    else:
+        return Vectorised(context, chain)
+
+class VAssembler(ArrayChain):
+    """
+    Array-backed Assembler.
+    >>> from core.basis import Context
+    >>> c = Context()
+    >>> print VAssembler(c, 1, [2, 4], VAssembler(c, '5.6'), None, 7)
+    [1 2 4 5 . 6 . 7]
+    >>> print VAssembler(c)
+    []
+    """
+    __slots__ = ('__chains',)
+
+    def __init__(self, context, *values):
+        ArrayChain.__init__(self, context)
+        self.__chains = [vwrap(context, v) for v in values]
+
+    def sources(self):
+        return self.__chains
+
+    def compute(self):
+        if not self.__chains: return empty()
+        pairs = [c.arrays() for c in self.__chains]
+        return (numpy.concatenate([d for (d, _) in pairs]),
+                numpy.concatenate([m for (_, m) in pairs]))
+
+class VTransposer(ArrayChain):
+    """
+    Array-backed Transposer.
+    >>> from core.basis import Context
+    >>> c = Context()
+    >>> print VTransposer(c, [1, 2, None, 10], 30)
+    [31 32 . 40]
+    >>> print VTransposer(c, [1, 2, None, 10], [])
+    [1 2 . 10]
+    >>> print VTransposer(c, '9.9', '.')
+    [9 . 9]
+    """
+    __slots__ = ('__sourceChain', '__xposeChain')
+
+    def __init__(self, context, sourceChain, xposeChain):
+        ArrayChain.__init__(self, context)
+        self.__sourceChain = vwrap(context, sourceChain)
+        self.__xposeChain = wrap(context, xposeChain)
+
+    def sources(self):
+        return [self.__sourceChain, self.__xposeChain]
+
+    def compute(self):
+        v = self.__xposeChain[0]
+        (data, mask) = self.__sourceChain.arrays()
+        if v is None or v == 0:
+            return (data.copy(), mask.copy())
+        else:
+            return (numpy.where(mask, data + v, 0), mask.copy())
+
+class VIndexer(ArrayChain):
+    """
+    Array-backed Indexer.
+    >>> from core.basis import Context
+    >>> c = Context()
+    >>> print VIndexer(c, [66, -6, None, 23], [0, 2, 1, 3, -1, 17, None, 3])
+    [66 . -6 23 . . . 23]
+    >>> print VIndexer(c, [], [0, 1])
+    [. .]
+    """
+    __slots__ = ('__values', '__indices')
+
+    def __init__(self, context, values, indices):
+        ArrayChain.__init__(self, context)
+        self.__values = vwrap(context, values)
+        self.__indices = vwrap(context, indices)
+
+    def sources(self):
+        return [self.__values, self.__indices]
+
+    def compute(self):
+        (vd, vm) = self.__values.arrays()
+        (idx, im) = self.__indices.arrays()
+        n = len(vd)
+        valid = im & (idx >= 0) & (idx < n)
+        if n == 0:
+            return (numpy.zeros(len(idx), dtype=numpy.int64), valid)
+        safe = numpy.where(valid, idx, 0)
+        mask = valid & vm[safe]
+        return (numpy.where(mask, vd[safe], 0), mask)
+
+class VSelector(ArrayChain):
+    """
+    Array-backed Selector.
+    >>> from core.basis import Context
+    >>> c = Context()
+    >>> print VSelector(c, 1, [6, 7], [8, 9, 10], [3, 4])
+    [8 9 10]
+    >>> print VSelector(c, 17, [6, 7], [8, 9, 10], [3, 4])
+    []
+    """
+    __slots__ = ('__index', '__chains')
+
+    def __init__(self, context, index, *chains):
+        ArrayChain.__init__(self, context)
+        self.__index = wrap(context, index)
+        self.__chains = [vwrap(context, c) for c in chains]
+
+    def sources(self):
+        return [self.__index] + self.__chains
+
+    def dependencies(self):
+        chain = self.__chosen()
+        if chain is None:
+            return [self.__index]
+        else:
+            return [self.__index, chain]
+
+    def __chosen(self):
+        idx = self.__index[0]
+        if idx is None or idx < 0 or idx >= len(self.__chains):
+            return None
+        else:
+            return self.__chains[idx]
+
+    def compute(self):
+        chain = self.__chosen()
+        if chain is None:
+            return empty()
+        else:
+            (data, mask) = chain.arrays()
+            return (data.copy(), mask.copy())
+
+class VRanger(ArrayChain):
+    """
+    Array-backed Ranger: the parameters are as for Ranger, but the
+    whole vector is drawn in one operation. The values are the same
+    as a Ranger's with the same key would be.
+    >>> from core.basis import Context
+    >>> from lib.chains import Ranger
+    >>> c = Context(seed=3)
+    >>> r = VRanger(c, [1000, 10])
+    >>> c.tick()
+    >>> (r.length(), min(r.values()), max(r.values()))
+    (1000, 0, 9)
+    >>> d = Context(seed=3)
+    >>> s = Ranger(d, [1000, 10])
+    >>> d.tick()
+    >>> s.values() == r.values()
+    True
+    >>> print VRanger(c, [3, 0])
+    [. . .]
+    >>> print VRanger(c, [None, 14])
+    []
+    >>> VRanger(c, 14).length()
+    1
+    """
+    __slots__ = ('__params', '__key')
+
+    VOLATILE = True
+    MUTABLE = True
+
+    def __init__(self, context, params):
+        ArrayChain.__init__(self, context)
+        self.__params = wrap(context, params)
+        self.__key = context.newKey()
+
+    def sources(self):
+        return [self.__params]
+
+    def compute(self):
+        params = self.__params.values()
+        if len(params) == 1:
+            (n, lim) = (1, params[0])
+        elif len(params) > 1:
+            (n, lim) = params[:2]
+        else:
+            (n, lim) = (None, None)
+
+        if n is None or n < 0: n = 0
+        if lim is None or lim <= 0:
+            return (numpy.zeros(n, dtype=numpy.int64), numpy.zeros(n, dtype=bool))
+        else:
+            context = self._Chain__context
+            base = stream(context.seed(), context.now(), self.__key)
+            randoms = counterRandoms(base, n) % numpy.uint64(lim)
+            return (randoms.astype(numpy.int64), numpy.ones(n, dtype=bool))
+
+if __name__ == "__main__":
+    import sys
+    if numpy is None:
+        sys.stderr.write("NumPy not available: skipping lib.vectors tests\n")
+        sys.exit(0)
+    import doctest
+    from minimock import Mock
+    doctest.testmod(optionflags=doctest.REPORT_ONLY_FIRST_FAILURE
+                               |doctest.ELLIPSIS
+                               |doctest.NORMALIZE_WHITESPACE,
+                    verbose=False
+                   )
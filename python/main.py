@@ -48,3 +48,4 @@ input = Cycler(c, inputPatt, fan, firstIf=0, nextIf='..', loopIf='..')
 def clock(i):
     c.tick()
     input.fire(i)
+    c.settle()
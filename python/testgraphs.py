@@ -0,0 +1,16 @@
+"""
+Small graph factories (see core.batch) for doctests. They live in a
+module of their own so that worker processes can import them.
+"""
+
+from core.interfacing import Outputter
+from lib.chains import Ranger
+from lib.pulses import Cycler, Sprayer
+
+def melody(context, maxObject, length=4):
+    out = Outputter(maxObject, context, 0, 100, 100)
+    notes = Cycler(context, Ranger(context, [length, 12]), out.pitch, firstIf=1, nextIf='..', loopIf='..')
+    return Cycler(context, '1101', Sprayer(context, notes, out.emit), firstIf=0, nextIf='..', loopIf='..')
+
+def events(buf):
+    return list(buf.events())
@@ -1,7 +1,7 @@
 #!/bin/bash
 
 for f in `find . -name '*.py'`; do
-    if [[ $f != './main.py' ]]; then
+    if [[ $f != './main.py' && $f != './bench.py' ]]; then
 	echo TEST $f
 	PYTHONPATH=. python $f
     fi